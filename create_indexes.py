@@ -1,5 +1,8 @@
 from pymongo import MongoClient
 
 mongo_client = MongoClient('mongodb://localhost:27017')
+mongo_client['MiningDesignDecisions']['IssueLabels'].create_index('tags')
 for repo in mongo_client['JiraRepos'].list_collection_names():
     mongo_client['JiraRepos'][repo].create_index('id')
+    mongo_client['JiraRepos'][repo].create_index('key')
+    mongo_client['JiraRepos'][repo].create_index('downloaded_at')
@@ -8,6 +8,7 @@ from .routers import (
     projects,
     issues,
     jirarepos_download,
+    jobs,
     authentication,
     embeddings,
     ui,
@@ -16,6 +17,7 @@ from .routers import (
     bulk,
     files,
 )
+from .jobs import fail_interrupted_jobs
 from .streaming import ui_updates
 import uvicorn
 
@@ -29,6 +31,7 @@ app.include_router(issue_data.router)
 app.include_router(issue_ids.router)
 app.include_router(issues.router)
 app.include_router(jirarepos_download.router)
+app.include_router(jobs.router)
 app.include_router(manual_labels.router)
 app.include_router(models.router)
 app.include_router(projects.router)
@@ -39,6 +42,11 @@ app.include_router(ui.router)
 app.include_router(ui_updates.router)
 
 
+@app.on_event("startup")
+def startup():
+    fail_interrupted_jobs()
+
+
 def run_app():
     uvicorn.run(
         app,
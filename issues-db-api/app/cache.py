@@ -0,0 +1,90 @@
+import threading
+from time import monotonic
+
+from bson import json_util
+
+
+class TTLCache:
+    """
+    Thread-safe cache whose entries expire after ttl seconds. Use a ttl of None
+    for entries that only disappear when the cache is invalidated. With a
+    max_size, the entries that were set longest ago are evicted first.
+    """
+
+    def __init__(self, ttl: float | None, max_size: int | None = None):
+        self.__ttl = ttl
+        self.__max_size = max_size
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            if key not in self.__entries:
+                return default
+            expires_at, value = self.__entries[key]
+            if expires_at is not None and expires_at < monotonic():
+                del self.__entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        expires_at = None if self.__ttl is None else monotonic() + self.__ttl
+        with self.__lock:
+            # Re-inserted, so the dict stays in the order in which keys were set
+            self.__entries.pop(key, None)
+            self.__entries[key] = (expires_at, value)
+            if self.__max_size is not None:
+                while len(self.__entries) > self.__max_size:
+                    del self.__entries[next(iter(self.__entries))]
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+def normalize_filter(filter_: dict) -> str:
+    """
+    Returns a cache key for a Mongo filter that does not depend on the order
+    of the keys in the filter. Values are encoded as Extended JSON, so an
+    ObjectId and its string get different keys.
+    """
+    return json_util.dumps(filter_, sort_keys=True)
+
+
+# Counts of IssueLabels documents per filter, used for the pages in the UI
+issue_labels_counts = TTLCache(ttl=60)
+# Seconds and number of filters for which /statistics/aggregate results are kept
+STATISTICS_AGGREGATES_TTL = 600
+STATISTICS_AGGREGATES_MAX_SIZE = 128
+# Summary tables of all issues, which change when the statistics are calculated
+statistics_aggregates = TTLCache(
+    ttl=STATISTICS_AGGREGATES_TTL, max_size=STATISTICS_AGGREGATES_MAX_SIZE
+)
+# Summary tables per set of tags, which also change when the tags of issues change
+tagged_statistics_aggregates = TTLCache(
+    ttl=STATISTICS_AGGREGATES_TTL, max_size=STATISTICS_AGGREGATES_MAX_SIZE
+)
+
+
+def invalidate_issue_labels_counts():
+    """
+    Must be called after every write to the IssueLabels collection.
+    """
+    issue_labels_counts.invalidate()
+    # Aggregates that are filtered by tags depend on the IssueLabels
+    tagged_statistics_aggregates.invalidate()
+
+
+def invalidate_statistics_aggregates():
+    """
+    Must be called after every write to the Statistics collection.
+    """
+    statistics_aggregates.invalidate()
+    tagged_statistics_aggregates.invalidate()
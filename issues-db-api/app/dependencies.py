@@ -10,6 +10,8 @@ from app.schemas import (
     users_collection_schema,
     files_collection_schema,
     repo_info_collection_schema,
+    predictions_collection_schema,
+    jobs_collection_schema,
 )
 
 if os.environ.get("DOCKER", False):
@@ -17,6 +19,10 @@ if os.environ.get("DOCKER", False):
 else:
     mongo_client = MongoClient("mongodb://localhost:27017")
 
+# Where predictions are stored: "embedded" in IssueLabels, or in a separate
+# "collection" (see app/predictions.py)
+PREDICTIONS_STORAGE = os.environ.get("PREDICTIONS_STORAGE", "embedded")
+
 jira_repos_db = mongo_client["JiraRepos"]
 mining_add_db = mongo_client["MiningDesignDecisions"]
 fs = gridfs.GridFS(mongo_client["MiningDesignDecisions"])
@@ -28,10 +34,38 @@ projects_collection = mongo_client["MiningDesignDecisions"]["Projects"]
 models_collection = mongo_client["MiningDesignDecisions"]["DLModels"]
 embeddings_collection = mongo_client["MiningDesignDecisions"]["DLEmbeddings"]
 files_collection = mongo_client["MiningDesignDecisions"]["Files"]
+predictions_collection = mongo_client["MiningDesignDecisions"]["Predictions"]
+jobs_collection = mongo_client["MiningDesignDecisions"]["Jobs"]
 statistics_collection = mongo_client["Statistics"]["Statistics"]
+statistics_watermarks_collection = mongo_client["Statistics"]["Watermarks"]
 users_collection = mongo_client["Users"]["Users"]
 
+
+def create_predictions_collection():
+    """
+    Creates the Predictions collection, which is only used when
+    PREDICTIONS_STORAGE is "collection".
+    """
+    if "Predictions" not in mining_add_db.list_collection_names():
+        mining_add_db.create_collection(
+            "Predictions", validator=predictions_collection_schema
+        )
+    predictions_collection.create_index(
+        [("model_id", 1), ("version_id", 1), ("issue_id", 1)], unique=True
+    )
+
+
 # Create non-existing collections with schema validation
+def create_jira_repo_indexes(repo: str):
+    """
+    Creates the indexes of a JiraRepos collection. Downloads call this before
+    their first write, so the upserts of a new repo do not scan the collection.
+    """
+    jira_repos_db[repo].create_index("id")
+    jira_repos_db[repo].create_index("key")
+    jira_repos_db[repo].create_index("downloaded_at")
+
+
 existing_collections = mining_add_db.list_collection_names()
 if "IssueLabels" not in existing_collections:
     mining_add_db.create_collection(
@@ -51,10 +85,16 @@ if "DLEmbeddings" not in existing_collections:
     )
 if "Files" not in existing_collections:
     mining_add_db.create_collection("Files", validator=files_collection_schema)
+if "Jobs" not in existing_collections:
+    mining_add_db.create_collection("Jobs", validator=jobs_collection_schema)
 
 if "Users" not in mongo_client["Users"].list_collection_names():
     mongo_client["Users"].create_collection("Users", validator=users_collection_schema)
 
+if PREDICTIONS_STORAGE == "collection":
+    create_predictions_collection()
+
 # Create indexes
+issue_labels_collection.create_index("tags")
 for repo in jira_repos_db.list_collection_names():
-    jira_repos_db[repo].create_index("id")
+    create_jira_repo_indexes(repo)
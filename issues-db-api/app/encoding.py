@@ -0,0 +1,98 @@
+import json
+import typing
+
+from app.exceptions import format_not_available_exception
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Supported stream formats
+JSON = "json"
+NDJSON = "ndjson"
+MSGPACK = "msgpack"
+
+media_types = {
+    JSON: "text/event-stream",
+    NDJSON: "application/x-ndjson",
+    MSGPACK: "application/msgpack",
+}
+
+accepted_media_types = {
+    "application/x-ndjson": NDJSON,
+    "application/ndjson": NDJSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+}
+
+
+def dumps(obj) -> bytes:
+    """
+    Serializes obj to JSON bytes, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def negotiate_format(accept: str | None) -> str:
+    """
+    Picks the stream format from the first supported media type in an Accept
+    header. Anything that is not NDJSON or MessagePack gets the default JSON
+    object framing.
+    """
+    if accept is None:
+        return JSON
+    for media_range in accept.split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in accepted_media_types:
+            stream_format = accepted_media_types[media_type]
+            if stream_format == MSGPACK and msgpack is None:
+                raise format_not_available_exception(media_type)
+            return stream_format
+        if media_type in (media_types[JSON], "application/json", "*/*"):
+            return JSON
+    return JSON
+
+
+def stream_records(
+    records: typing.Iterable[tuple[str, typing.Any]],
+    stream_format: str,
+    field: str = "data",
+    key_name: str = "issue_id",
+    trailer: typing.Callable[[], dict] | None = None,
+):
+    """
+    Encodes (key, value) records in the given stream format. JSON gives a single
+    {field: {key: value, ...}} object, NDJSON gives one {key_name: key, field:
+    value} object per line and MessagePack gives a sequence of those objects.
+    The optional trailer is called after the last record; its items are added to
+    the JSON object, or sent as a final object in the other formats.
+    """
+    if stream_format == NDJSON:
+        for key, value in records:
+            yield dumps({key_name: key, field: value}) + b"\n"
+        if trailer is not None:
+            yield dumps(trailer()) + b"\n"
+    elif stream_format == MSGPACK:
+        for key, value in records:
+            yield msgpack.packb({key_name: key, field: value})
+        if trailer is not None:
+            yield msgpack.packb(trailer())
+    else:
+        yield b'{"' + field.encode("utf-8") + b'": {'
+        separator = b""
+        for key, value in records:
+            yield separator + dumps(key) + b": " + dumps(value)
+            separator = b","
+        yield b"}"
+        if trailer is not None:
+            for key, value in trailer().items():
+                yield b", " + dumps(key) + b": " + dumps(value)
+        yield b"}"
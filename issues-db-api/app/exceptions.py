@@ -130,6 +130,18 @@ def ui_sort_exception(syntax_error: str):
     return HTTPException(status_code=422, detail=f"Cannot sort on: {syntax_error}")
 
 
+def ui_prediction_filter_exception(field: str):
+    return HTTPException(
+        status_code=422,
+        detail=f"Cannot filter on {field} when predictions are stored in the "
+        f"Predictions collection",
+    )
+
+
+def invalid_continuation_token_exception(token: str):
+    return HTTPException(status_code=422, detail=f"Invalid continuation token: {token}")
+
+
 def version_not_specified_exception(model: str):
     return HTTPException(
         status_code=422, detail=f"Version not specified for model: {model}"
@@ -152,6 +164,12 @@ def url_not_working_exception(url: str):
     return HTTPException(status_code=502, detail=f"The url does not work: {url}")
 
 
+def repos_download_failed_exception(errors: dict[str, str]):
+    return HTTPException(
+        status_code=502, detail=f"The download of the following repos failed: {errors}"
+    )
+
+
 def wrong_date_format(date: str):
     return HTTPException(
         status_code=422,
@@ -172,3 +190,25 @@ def wrong_wait_time(query_wait_time_minutes: float):
         detail=f"query_wait_time_minutes {query_wait_time_minutes} should be greater "
         f"than or equal to 0.0",
     )
+
+
+def unknown_statistics_fields_exception(fields: list[str]):
+    return HTTPException(
+        status_code=422, detail=f"The following statistics do not exist: {fields}"
+    )
+
+
+def format_not_available_exception(media_type: str):
+    return HTTPException(
+        status_code=406, detail=f"Stream format {media_type} is not available"
+    )
+
+
+def job_not_found_exception(job_id: str):
+    return HTTPException(status_code=404, detail=f"Job {job_id} was not found")
+
+
+def job_finished_exception(job_id: str, status: str):
+    return HTTPException(
+        status_code=409, detail=f"Job {job_id} is already finished ({status})"
+    )
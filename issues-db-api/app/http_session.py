@@ -0,0 +1,53 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Connections that are kept open per Jira host. Requests beyond this wait for a
+# free connection instead of opening (and TLS handshaking) a new one.
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("MAX_CONNECTIONS_PER_HOST", 4))
+# Number of hosts for which a connection pool is kept
+MAX_POOLED_HOSTS = 32
+# Seconds to wait for a connection or a response
+REQUEST_TIMEOUT = 120
+
+# Exponential backoff (1s, 2s, 4s, ... up to 120s) on connection errors and on
+# 429/5xx responses. The Retry-After header of 429 and 503 responses is honored.
+retry = Retry(
+    total=8,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["HEAD", "GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# The adapter is shared, so all sessions share the connection pools per host
+adapter = HTTPAdapter(
+    pool_connections=MAX_POOLED_HOSTS,
+    pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+    pool_block=True,
+    max_retries=retry,
+)
+
+
+def configure_session(session: requests.Session):
+    """
+    Mounts the pooled, retrying adapter on the session.
+    """
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_jira_session(jira):
+    """
+    Mounts the adapter on the session of a JIRA client. The client has no public
+    way to pass in a session, so this relies on JIRA._session of the jira version
+    pinned in requirements.txt (3.5.2). Check it when upgrading jira.
+    """
+    return configure_session(jira._session)
+
+
+session = configure_session(requests.Session())
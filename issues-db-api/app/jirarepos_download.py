@@ -1,11 +1,23 @@
-from time import sleep
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from threading import Lock, Semaphore
+from time import monotonic, sleep
 from time import time  # To time the duration of the requests
+from urllib.parse import urlparse
 
 import requests  # To get the data
 import urllib3
+from app.cache import invalidate_issue_labels_counts
 from app.dependencies import jira_repos_db, issue_labels_collection
-from app.exceptions import url_not_working_exception
+from app.http_session import session, configure_jira_session, REQUEST_TIMEOUT
+from app.exceptions import url_not_working_exception, repos_download_failed_exception
+from app.jobs import JobCancelled
+from app.routers.issue_data import default_value, value_converters
+from app.util import bulk_write_in_batches, prefetch_in_order
 from jira import JIRA
+from pymongo import ReplaceOne, UpdateOne
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -27,22 +39,129 @@ APACHE_AUTH_PROJECTS = [
     "YOKO",
 ]
 
+# Number of repos that are downloaded at the same time from one Jira server
+MAX_DOWNLOADS_PER_HOST = int(os.environ.get("MAX_DOWNLOADS_PER_HOST", 1))
+# Number of search requests per minute that may be sent to one Jira server
+MAX_REQUESTS_PER_MINUTE_PER_HOST = float(
+    os.environ.get("MAX_REQUESTS_PER_MINUTE_PER_HOST", 60)
+)
+# Fields that the statistics and the UI read
+STATISTICS_FIELDS = [
+    "summary",
+    "description",
+    "issuetype",
+    "status",
+    "resolution",
+    "created",
+    "updated",
+    "resolutiondate",
+    "labels",
+    "subtasks",
+    "attachment",
+    "watches",
+    "votes",
+    "comment",
+]
+# Fields that the API itself reads, these are always part of a download profile:
+# the fields above and every attribute that /issue-data converts or defaults
+REQUIRED_FIELDS = list(
+    dict.fromkeys(STATISTICS_FIELDS + list(default_value) + list(value_converters))
+)
+
+# Number of search pages that are fetched ahead of the writer of a repo
+PREFETCH_PAGES = int(os.environ.get("JIRA_PREFETCH_PAGES", 4))
+
+
+class RateLimiter:
+    """
+    Spaces out the requests of all threads that share the limiter, such that at
+    most requests_per_minute requests are sent.
+    """
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60 / requests_per_minute
+        self.next_time = monotonic()
+        self.lock = Lock()
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            sleep(wait_time)
+
+
+class HostBudget:
+    """
+    Concurrency and rate limit budget of one Jira server.
+    """
+
+    def __init__(self):
+        self.semaphore = Semaphore(MAX_DOWNLOADS_PER_HOST)
+        self.rate_limiter = RateLimiter(MAX_REQUESTS_PER_MINUTE_PER_HOST)
+
+
+def download_concurrently(repo_infos, download_repo):
+    """
+    Calls download_repo(repo_info, rate_limiter) for all repos. Repos on different
+    Jira servers are downloaded in parallel, repos on the same server share its
+    HostBudget. Failing repos do not stop the others, the failures are raised
+    once all downloads are done.
+    """
+    if not repo_infos:
+        return
+    budgets = {}
+    for repo_info in repo_infos:
+        host = urlparse(repo_info["repo_url"]).netloc
+        budgets.setdefault(host, HostBudget())
+
+    def download(repo_info):
+        budget = budgets[urlparse(repo_info["repo_url"]).netloc]
+        with budget.semaphore:
+            download_repo(repo_info, budget.rate_limiter)
+
+    errors = {}
+    with ThreadPoolExecutor(
+        max_workers=len(budgets) * MAX_DOWNLOADS_PER_HOST,
+        thread_name_prefix="jira-download",
+    ) as executor:
+        futures = {
+            repo_info["_id"]: executor.submit(download, repo_info)
+            for repo_info in repo_infos
+        }
+        for repo, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Download of {repo} failed: {e!r}")
+                errors[repo] = e
+    for error in errors.values():
+        if isinstance(error, JobCancelled):
+            raise error
+    if errors:
+        raise repos_download_failed_exception(
+            {repo: str(getattr(e, "detail", e)) for repo, e in errors.items()}
+        )
+
 
 def check_jira_url(jira_url):
     try:
-        requests.head(jira_url)
-    except ConnectionError:
+        session.head(jira_url, timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.ConnectionError:
         raise url_not_working_exception(jira_url)
 
     # CHECK PROVIDED JIRA URL API AVAILABILITY
-    response = requests.get(jira_url + "/rest/api/2/issuetype")
+    response = session.get(jira_url + "/rest/api/2/issuetype", timeout=REQUEST_TIMEOUT)
     if response.status_code >= 300:
-        return url_not_working_exception(jira_url)
+        raise url_not_working_exception(jira_url)
 
     # CHECK NUMBER OF ISSUES
-    response = requests.get(jira_url + "/rest/api/2/search?jql=&maxResults=0")
+    response = session.get(
+        jira_url + "/rest/api/2/search?jql=&maxResults=0", timeout=REQUEST_TIMEOUT
+    )
     if response.status_code >= 300:
-        return url_not_working_exception(jira_url)
+        raise url_not_working_exception(jira_url)
 
 
 def format_duration(start_time, end_time):
@@ -61,24 +180,152 @@ def format_duration(start_time, end_time):
 
 def get_jira_server(jira_name, url, enable_auth=False, username=None, password=None):
     check_jira_url(url)
+    # Retries are done by the pooled adapter of configure_session
     if enable_auth and jira_name == "Apache":
-        return JIRA(url, basic_auth=(username, password))
-    return JIRA(url)
+        jira = JIRA(
+            url,
+            basic_auth=(username, password),
+            max_retries=0,
+            timeout=REQUEST_TIMEOUT,
+        )
+    else:
+        jira = JIRA(url, max_retries=0, timeout=REQUEST_TIMEOUT)
+    configure_jira_session(jira)
+    return jira
 
 
-def get_response(jira, download_date, start_index, iteration_max=100):
+def get_query(download_date):
     if download_date is None:
-        query = f"order by created asc"
-    else:
-        query = f'updated>="{download_date}" order by created asc'
+        return f"order by created asc"
+    return f'updated>="{download_date}" order by created asc'
+
+
+def get_search_options(fields=None, changelog=True):
+    """
+    Returns the search_issues arguments of a download profile. Only the given
+    fields are downloaded, together with the REQUIRED_FIELDS, or all fields when
+    fields is None. The changelog is only expanded when changelog is set.
+    """
+    options = {"fields": "*all", "expand": "changelog" if changelog else None}
+    if fields is not None:
+        options["fields"] = ",".join(dict.fromkeys(REQUIRED_FIELDS + fields))
+    return options
+
+
+def get_response(
+    jira,
+    download_date,
+    start_index,
+    iteration_max=100,
+    rate_limiter=None,
+    search_options=None,
+):
+    if rate_limiter is not None:
+        rate_limiter.wait()
     return jira.search_issues(
-        query,
+        get_query(download_date),
         startAt={start_index},
         maxResults={iteration_max},
-        expand="changelog",
         json_result=True,
+        **(search_options or get_search_options()),
+    )
+
+
+def write_issues(jira_name, issues):
+    """
+    Upserts the downloaded issues into JiraRepos and their IssueLabels, moving the
+    project tag of issues whose key changed, in unordered bulk_write batches. Every
+    issue gets the time of this write, in UTC, as downloaded_at.
+    """
+    if not issues:
+        return
+    collection = jira_repos_db[jira_name]
+
+    # The last download of an issue wins
+    issues = list({issue["id"]: issue for issue in issues}.values())
+    old_keys = {
+        issue["id"]: issue["key"]
+        for issue in collection.find(
+            {"id": {"$in": [issue["id"] for issue in issues]}}, ["id", "key"]
+        )
+    }
+
+    downloaded_at = datetime.utcnow()
+    bulk_write_in_batches(
+        collection,
+        (
+            ReplaceOne(
+                {"id": issue["id"]},
+                {**issue, "downloaded_at": downloaded_at},
+                upsert=True,
+            )
+            for issue in issues
+        ),
     )
 
+    label_operations = []
+    for issue in issues:
+        _id = f"{jira_name}-{issue['id']}"
+        new_tag = f"{jira_name}-{issue['key'].split('-')[0]}"
+        if issue["id"] in old_keys:
+            old_tag = f"{jira_name}-{old_keys[issue['id']].split('-')[0]}"
+            if old_tag != new_tag:
+                # Does not conflict with the $addToSet below, so order is irrelevant
+                label_operations.append(
+                    UpdateOne({"_id": _id}, {"$pull": {"tags": old_tag}})
+                )
+        label_operations.append(
+            UpdateOne(
+                {"_id": _id},
+                {
+                    "$setOnInsert": {
+                        "existence": None,
+                        "property": None,
+                        "executive": None,
+                        "comments": {},
+                        "predictions": {},
+                    },
+                    "$addToSet": {"tags": new_tag},
+                },
+                upsert=True,
+            )
+        )
+    bulk_write_in_batches(issue_labels_collection, label_operations)
+    invalidate_issue_labels_counts()
+
+
+def fetch_page(
+    jira_server,
+    download_date,
+    start_index,
+    page_size,
+    rate_limiter,
+    search_options,
+    page_limiter=None,
+):
+    """
+    Returns (start_index, issues, duration) of one page of search results. When
+    Jira returns fewer results than requested, the rest of the page is requested
+    separately, so pages fetched ahead never leave gaps.
+    """
+    if page_limiter is not None:
+        page_limiter.wait()
+    start_time = time()
+    issues = []
+    while len(issues) < page_size:
+        response_json = get_response(
+            jira_server,
+            download_date,
+            start_index + len(issues),
+            page_size - len(issues),
+            rate_limiter,
+            search_options=search_options,
+        )
+        if not response_json.get("issues"):
+            break
+        issues.extend(response_json["issues"])
+    return start_index, issues, time() - start_time
+
 
 def download_and_write_data_mongo(
     jira_name,
@@ -89,23 +336,22 @@ def download_and_write_data_mongo(
     start_index=0,  # This allows you to start back up from a different place
     num_available_results=None,
     enable_auth=False,
+    job=None,
+    rate_limiter=None,
+    save_checkpoint=None,
+    search_options=None,
+    query_wait_time_minutes=0,
 ):
-    collection = jira_repos_db[jira_name]
-
     # iteration_max is the number of issues the script will attempt to get at one time.
     # The Jira default max is 1000. Trying with 1000 consistently returned errors after a short while
     # as the object being returned was likely too large. Values of 500 or less serve no particular issue
     # to the script except that more calls (of smaller size) have to be made.
 
-    # How many issues to collect before writing to MongoDB
-    num_issues_per_write = 10000
-
-    last_write_start_index = start_index
-    issues = []
-
     if num_available_results is None:
         # Available and requested number of results
-        num_available_results = get_response(jira_server, download_date, 0, 0)["total"]
+        num_available_results = get_response(
+            jira_server, download_date, 0, 0, rate_limiter
+        )["total"]
         print(
             f'Number of Desired Results   : {num_desired_results if num_desired_results else "All"}'
         )
@@ -114,103 +360,71 @@ def download_and_write_data_mongo(
 
     # Set the number of results to retrieve based on information from Jira server
     if not num_desired_results:
-        num_remaining_results = num_available_results
+        end_index = num_available_results
     else:
-        num_remaining_results = min(int(num_desired_results), num_available_results)
-    # Adjust remaining results based on their start index
-    num_remaining_results -= start_index
+        end_index = min(int(num_desired_results), num_available_results)
+    num_remaining_results = end_index - start_index
+
+    # Pages start at least query_wait_time_minutes apart. Despite its name, the
+    # setting is applied in seconds, and the stored repos rely on it.
+    page_limiter = None
+    if query_wait_time_minutes > 0:
+        page_limiter = RateLimiter(60 / query_wait_time_minutes)
+
+    # Pages are fetched ahead on PREFETCH_PAGES threads while the writer stores
+    # the pages before them, so network and database are busy at the same time.
+    # Every page is written as soon as it arrives, so at most PREFETCH_PAGES
+    # pages and the page that is being written are held in memory.
+    pages = prefetch_in_order(
+        (
+            partial(
+                fetch_page,
+                jira_server,
+                download_date,
+                page_start,
+                min(iteration_max, end_index - page_start),
+                rate_limiter,
+                search_options,
+                page_limiter,
+            )
+            for page_start in range(start_index, end_index, iteration_max)
+        ),
+        max_workers=PREFETCH_PAGES,
+    )
 
-    # Collect results while there are more results to gather
     issues_downloaded = 0
+
+    # Collect results while there are more results to gather
     max_count_width = len(str(num_remaining_results)) + 1
     print(f"Total Remaining:{num_remaining_results:< {max_count_width}}")
-    while num_remaining_results > 0:
-        # Start a timer for this particular chunk
-        start_time = time()
-
-        # Number of items to retrieve
-        num_items_to_retrieve = min(iteration_max, num_remaining_results)
+    for page_start, page_issues, duration in pages:
+        num_returned_issues = len(page_issues)
 
-        # Get issues from Jira
-        response_json = get_response(
-            jira_server, download_date, start_index, num_items_to_retrieve
-        )
-        if "issues" in response_json:
-            # Add issues to program list
-            issues.extend(response_json["issues"])
-            num_returned_issues = len(response_json["issues"])
+        # If we have for some reason run out of results, we may want to react to this in some way
+        if num_returned_issues == 0:
+            print(
+                "Number of Returned Issues is 0. This is strange and should not happen. Investigate."
+            )
+            break
 
         # Adjust the remaining results to get
         num_remaining_results -= num_returned_issues
 
         # Print progress for user
-        end_index = start_index + num_returned_issues - 1
+        page_end = page_start + num_returned_issues - 1
         print(
             f"Total Remaining:{num_remaining_results:< {max_count_width}}  "
-            f"Retrieved Items: {start_index:< {max_count_width}} - {end_index:< {max_count_width}}  "
-            f"Duration: {format_duration(start_time, time())}"
+            f"Retrieved Items: {page_start:< {max_count_width}} - {page_end:< {max_count_width}}  "
+            f"Duration: {format_duration(0, duration)}"
         )
 
-        # Move the start index
-        start_index += num_returned_issues
-
-        # Write the issues to file IF there are enough of them. This is a nice way to save state and start over at a
-        # certain place if there are too many to download in one go.
-        if (
-            len(issues) >= num_issues_per_write
-            or num_remaining_results == 0
-            or num_returned_issues == 0
-        ):
-            # Delete existing issues before updating
-            for issue in issues:
-                # Remove old tag
-                old_issue = collection.find_one({"id": issue["id"]})
-                if not old_issue:
-                    continue
-                old_tag = old_issue["key"].split("-")[0]
-                issue_labels_collection.update_one(
-                    {"_id": f"{jira_name}-{issue['id']}"},
-                    {"$pull": {"tags": f"{jira_name}-{old_tag}"}},
-                )
-            ids = [issue["id"] for issue in issues]
-            collection.delete_many({"id": {"$in": ids}})
-
-            # Write the data to mongodb
-            collection.insert_many(issues)
-            for issue in issues:
-                issue_label = issue_labels_collection.find_one(
-                    {"_id": f"{jira_name}-{issue['id']}"}
-                )
-                if issue_label is None:
-                    issue_labels_collection.insert_one(
-                        {
-                            "_id": f"{jira_name}-{issue['id']}",
-                            "existence": None,
-                            "property": None,
-                            "executive": None,
-                            "tags": [],
-                            "comments": {},
-                            "predictions": {},
-                        }
-                    )
-                new_tag = issue["key"].split("-")[0]
-                issue_labels_collection.update_one(
-                    {"_id": f"{jira_name}-{issue['id']}"},
-                    {"$addToSet": {"tags": f"{jira_name}-{new_tag}"}},
-                )
-
-            print("... Issues written to database ...")
-            last_write_start_index = start_index
-
-            issues_downloaded += len(issues)
-            issues = []  # Clear the issues so that our memory doesn't get too full
-
-        # If we have for some reason run out of results, we may want to react to this in some way
-        if num_returned_issues == 0:
-            print(
-                "Number of Returned Issues is 0. This is strange and should not happen. Investigate."
-            )
-            return
+        write_issues(jira_name, page_issues)
+        issues_downloaded += num_returned_issues
+        if save_checkpoint is not None:
+            # Pages are written in order, so everything before this index is stored
+            save_checkpoint(start_index + issues_downloaded)
+        if job is not None:
+            job.advance(num_returned_issues)
 
     print("")
     print(f"Number of Downloaded Issues: {issues_downloaded}")
@@ -226,26 +440,21 @@ def download_multiprocessed(
     username=None,
     password=None,
     start_index=0,
+    job=None,
+    rate_limiter=None,
+    save_checkpoint=None,
+    search_options=None,
 ):
     # Available and requested number of results
     jira_server = get_jira_server(
         jira_name, url, enable_auth=enable_auth, username=username, password=password
     )
-    num_available_results = get_response(jira_server, download_date, 0, 0)["total"]
+    num_available_results = get_response(
+        jira_server, download_date, 0, 0, rate_limiter
+    )["total"]
     print(f"Total issues to download from {jira_name}: {num_available_results}")
-    while start_index + batch_size <= num_available_results:
-        download_and_write_data_mongo(
-            jira_name,
-            jira_server,
-            download_date,
-            start_index + batch_size,
-            batch_size,
-            start_index,
-            num_available_results,
-            enable_auth,
-        )
-        start_index += batch_size
-        sleep(query_wait_time_minutes)
+    if job is not None:
+        job.add_total(num_available_results - start_index)
     download_and_write_data_mongo(
         jira_name,
         jira_server,
@@ -255,4 +464,9 @@ def download_multiprocessed(
         start_index,
         num_available_results,
         enable_auth,
+        job,
+        rate_limiter,
+        save_checkpoint,
+        search_options,
+        query_wait_time_minutes,
     )
@@ -0,0 +1,200 @@
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.dependencies import jobs_collection
+
+# Number of jobs that run at the same time, other jobs wait in "pending"
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Minimum number of seconds between two progress writes of a job
+PROGRESS_INTERVAL = 1.0
+
+# Seconds between two heartbeats of the unfinished jobs of this process
+HEARTBEAT_INTERVAL = 30
+# Unfinished jobs without a heartbeat for this long belong to a stopped process
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+UNFINISHED_STATUSES = ("pending", "running")
+
+# Identifies the jobs of this process. Several API workers share the Jobs
+# collection, and a pid may be reused after a restart.
+OWNER = {
+    "host": socket.gethostname(),
+    "pid": os.getpid(),
+    "instance_id": uuid.uuid4().hex,
+}
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    Handle that is passed to a running job to report its progress. Cancellation
+    is cooperative: advance() and check_cancelled() raise JobCancelled once a
+    cancel was requested through the Jobs collection.
+    """
+
+    def __init__(self, job_id: ObjectId):
+        self.job_id = job_id
+        self.total = 0
+        self.done = 0
+        self._last_write = monotonic()
+        # A job may report progress from several threads
+        self._lock = Lock()
+
+    def add_total(self, amount: int):
+        with self._lock:
+            self.total += amount
+            self._write()
+
+    def advance(self, amount: int = 1):
+        with self._lock:
+            self.done += amount
+            if monotonic() - self._last_write >= PROGRESS_INTERVAL:
+                self._write()
+
+    def check_cancelled(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        job = jobs_collection.find_one_and_update(
+            {"_id": self.job_id},
+            {
+                "$set": {
+                    "total": self.total,
+                    "done": self.done,
+                    "heartbeat_at": datetime.utcnow(),
+                }
+            },
+            ["cancel_requested"],
+        )
+        self._last_write = monotonic()
+        if job is None or job["cancel_requested"]:
+            raise JobCancelled()
+
+
+def _heartbeat():
+    while True:
+        sleep(HEARTBEAT_INTERVAL)
+        try:
+            jobs_collection.update_many(
+                {
+                    "owner.instance_id": OWNER["instance_id"],
+                    "status": {"$in": list(UNFINISHED_STATUSES)},
+                },
+                {"$set": {"heartbeat_at": datetime.utcnow()}},
+            )
+        except Exception as e:
+            print(f"Job heartbeat failed: {e!r}")
+
+
+_heartbeat_thread = Thread(target=_heartbeat, name="job-heartbeat", daemon=True)
+_heartbeat_lock = Lock()
+
+
+def _start_heartbeat():
+    with _heartbeat_lock:
+        if not _heartbeat_thread.is_alive():
+            _heartbeat_thread.start()
+
+
+def _finish(job_id: ObjectId, status: str, error: str | None = None):
+    jobs_collection.update_one(
+        {"_id": job_id},
+        {
+            "$set": {
+                "status": status,
+                "error": error,
+                "finished_at": datetime.utcnow(),
+            }
+        },
+    )
+
+
+def _run(job_id: ObjectId, func, args, kwargs):
+    job = jobs_collection.find_one_and_update(
+        {"_id": job_id, "status": "pending", "cancel_requested": False},
+        {"$set": {"status": "running", "started_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        # Cancelled before it was started
+        _finish(job_id, "cancelled")
+        return
+    handle = Job(job_id)
+    try:
+        func(handle, *args, **kwargs)
+    except JobCancelled:
+        _finish(job_id, "cancelled")
+    except Exception as e:
+        print(f"Job {job_id} ({job['name']}) failed: {e!r}")
+        _finish(job_id, "failed", str(getattr(e, "detail", e)))
+    else:
+        jobs_collection.update_one(
+            {"_id": job_id}, {"$set": {"total": handle.total, "done": handle.done}}
+        )
+        _finish(job_id, "completed")
+
+
+def submit_job(name: str, func, *args, **kwargs) -> str:
+    """
+    Stores a pending job and runs func(job, *args, **kwargs) on the worker pool.
+    Returns the job id.
+    """
+    _start_heartbeat()
+    now = datetime.utcnow()
+    job_id = jobs_collection.insert_one(
+        {
+            "name": name,
+            "status": "pending",
+            "total": 0,
+            "done": 0,
+            "cancel_requested": False,
+            "error": None,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "owner": OWNER,
+            "heartbeat_at": now,
+        }
+    ).inserted_id
+    _executor.submit(_run, job_id, func, args, kwargs)
+    return str(job_id)
+
+
+def fail_interrupted_jobs():
+    """
+    Marks the pending and running jobs of stopped API processes as failed. The
+    jobs of running processes are recognized by their recent heartbeat.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=HEARTBEAT_TIMEOUT)
+    jobs_collection.update_many(
+        {
+            "status": {"$in": list(UNFINISHED_STATUSES)},
+            "$or": [
+                {"heartbeat_at": {"$lt": stale_before}},
+                # Jobs from before heartbeats were recorded
+                {"heartbeat_at": {"$exists": False}},
+            ],
+        },
+        {
+            "$set": {
+                "status": "failed",
+                "error": "Interrupted by a restart of the API",
+                "finished_at": datetime.utcnow(),
+            }
+        },
+    )
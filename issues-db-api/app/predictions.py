@@ -0,0 +1,364 @@
+from pymongo import UpdateOne
+
+from app.cache import invalidate_issue_labels_counts
+from app.dependencies import (
+    PREDICTIONS_STORAGE,
+    issue_labels_collection,
+    predictions_collection,
+)
+from app.exceptions import ui_prediction_filter_exception
+from app.util import find_missing_ids
+
+
+def _find_issue_labels(
+    filter_: dict,
+    sort: list[tuple[str, int]] | None,
+    limit: int,
+    skip: int,
+    seek_filter: dict | None,
+):
+    if seek_filter is not None:
+        filter_ = {"$and": [filter_, seek_filter]}
+    issues = issue_labels_collection.find(filter_)
+    if sort:
+        issues = issues.sort(sort)
+    return list(issues.skip(skip).limit(limit))
+
+
+def _rename_fields(filter_: dict, rename) -> dict:
+    """
+    Returns the filter with rename(field) applied to the fields of its
+    (nested $and/$or/$nor) conditions.
+    """
+    renamed = {}
+    for key, value in filter_.items():
+        if key in ("$and", "$or", "$nor"):
+            renamed[key] = [_rename_fields(sub_filter, rename) for sub_filter in value]
+        else:
+            renamed[rename(key)] = value
+    return renamed
+
+
+def _filter_fields(filter_: dict):
+    """
+    Yields the fields of the (nested $and/$or/$nor) conditions of a filter.
+    """
+    for key, value in filter_.items():
+        if key in ("$and", "$or", "$nor"):
+            for sub_filter in value:
+                yield from _filter_fields(sub_filter)
+        elif not key.startswith("$"):
+            yield key
+
+
+class EmbeddedPredictionStore:
+    """
+    Stores the predictions of a model version as predictions.<model>-<version>
+    inside the IssueLabels documents, with an index per predicted class.
+    """
+
+    def write(self, model_id: str, version_id: str, batch: list[tuple[str, dict]]):
+        """
+        Writes a batch of (issue_id, predictions) and returns the ids that might
+        not exist in IssueLabels.
+        """
+        result = issue_labels_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": issue_id},
+                    {"$set": {f"predictions.{model_id}-{version_id}": predictions}},
+                )
+                for issue_id, predictions in batch
+            ],
+            ordered=False,
+        )
+        invalidate_issue_labels_counts()
+        if result.matched_count < len(batch):
+            return [issue_id for issue_id, _ in batch]
+        return []
+
+    def create_indexes(self, model_id: str, version_id: str, classes: set[str]):
+        for class_ in classes:
+            # Make sure the predictions are indexed for (keyset) sorting in the UI
+            issue_labels_collection.create_index(
+                [
+                    (f"predictions.{model_id}-{version_id}.{class_}.confidence", 1),
+                    ("_id", 1),
+                ]
+            )
+
+    def find(
+        self,
+        model_id: str,
+        version_id: str,
+        issue_ids: list[str] | None,
+        batch_size: int,
+    ):
+        """
+        Yields (issue_id, predictions) for the issues that have predictions of
+        the model version, optionally restricted to the given issue ids.
+        """
+        filter_ = {f"predictions.{model_id}-{version_id}": {"$exists": True}}
+        if issue_ids is not None:
+            filter_ = {"$and": [{"_id": {"$in": issue_ids}}, filter_]}
+        issues = issue_labels_collection.find(
+            filter_, [f"predictions.{model_id}-{version_id}"], batch_size=batch_size
+        )
+        for issue in issues:
+            yield issue["_id"], issue["predictions"][f"{model_id}-{version_id}"]
+
+    def get_for_issues(self, issues: list[dict], models: list[str]):
+        """
+        Returns {issue_id: {model-version: predictions}} for IssueLabels documents
+        that were already fetched.
+        """
+        return {
+            issue["_id"]: {
+                model: issue["predictions"][model]
+                for model in models
+                if model in issue.get("predictions", {})
+            }
+            for issue in issues
+        }
+
+    def check_filter(self, filter_: dict):
+        """
+        Raises an HTTPException when the IssueLabels filter cannot be applied.
+        """
+
+    def count_issues(self, filter_: dict, sort: list[tuple[str, int]] | None):
+        """
+        Returns the number of issues that find_issues pages over, or None when
+        that is the number of IssueLabels documents that match the filter.
+        """
+        return None
+
+    def find_issues(
+        self,
+        filter_: dict,
+        sort: list[tuple[str, int]] | None,
+        limit: int,
+        skip: int = 0,
+        seek_filter: dict | None = None,
+    ):
+        """
+        Returns a page of IssueLabels documents, where sort may refer to
+        predictions.<model>-<version>.<class>.confidence. The seek_filter is
+        applied after the predictions are available for the sort.
+        """
+        return _find_issue_labels(filter_, sort, limit, skip, seek_filter)
+
+    def delete(self, model_id: str, version_id: str):
+        # Remove predictions
+        issue_labels_collection.update_many(
+            {}, {"$unset": {f"predictions.{model_id}-{version_id}": ""}}
+        )
+        invalidate_issue_labels_counts()
+        # Remove indexes
+        indexes = issue_labels_collection.index_information()
+        for key, value in indexes.items():
+            for col in value["key"]:
+                if f"predictions.{model_id}-{version_id}" in col[0]:
+                    issue_labels_collection.drop_index(key)
+                    break
+
+
+class CollectionPredictionStore:
+    """
+    Stores one document per (issue, model, version) in the Predictions
+    collection, which is indexed on (model, version, issue) and per predicted
+    class. This keeps the IssueLabels documents and their indexes independent of
+    the number of model versions.
+    """
+
+    def write(self, model_id: str, version_id: str, batch: list[tuple[str, dict]]):
+        """
+        Writes a batch of (issue_id, predictions) and returns the ids that do not
+        exist in IssueLabels. Predictions of those issues are not stored.
+        """
+        missing_ids = set(
+            find_missing_ids(
+                issue_labels_collection, [issue_id for issue_id, _ in batch]
+            )
+        )
+        operations = [
+            UpdateOne(
+                {"model_id": model_id, "version_id": version_id, "issue_id": issue_id},
+                {"$set": {"predictions": predictions}},
+                upsert=True,
+            )
+            for issue_id, predictions in batch
+            if issue_id not in missing_ids
+        ]
+        if operations:
+            predictions_collection.bulk_write(operations, ordered=False)
+        # The /ui counts of prediction sorts depend on the Predictions
+        invalidate_issue_labels_counts()
+        return list(missing_ids)
+
+    def create_indexes(self, model_id: str, version_id: str, classes: set[str]):
+        for class_ in classes:
+            # Shared by all model versions that predict the class, so the number
+            # of indexes does not grow with the number of versions
+            predictions_collection.create_index(
+                [
+                    ("model_id", 1),
+                    ("version_id", 1),
+                    (f"predictions.{class_}.confidence", 1),
+                    ("issue_id", 1),
+                ]
+            )
+
+    def find(
+        self,
+        model_id: str,
+        version_id: str,
+        issue_ids: list[str] | None,
+        batch_size: int,
+    ):
+        filter_ = {"model_id": model_id, "version_id": version_id}
+        if issue_ids is not None:
+            filter_["issue_id"] = {"$in": issue_ids}
+        predictions = predictions_collection.find(
+            filter_, ["issue_id", "predictions"], batch_size=batch_size
+        )
+        for prediction in predictions:
+            yield prediction["issue_id"], prediction["predictions"]
+
+    def get_for_issues(self, issues: list[dict], models: list[str]):
+        issue_ids = [issue["_id"] for issue in issues]
+        result = {issue_id: {} for issue_id in issue_ids}
+        model_versions = [model.split("-") for model in models]
+        if not issue_ids or not model_versions:
+            return result
+        predictions = predictions_collection.find(
+            {
+                "$or": [
+                    {"model_id": model_id, "version_id": version_id}
+                    for model_id, version_id in model_versions
+                ],
+                "issue_id": {"$in": issue_ids},
+            }
+        )
+        for prediction in predictions:
+            result[prediction["issue_id"]][
+                f'{prediction["model_id"]}-{prediction["version_id"]}'
+            ] = prediction["predictions"]
+        return result
+
+    def check_filter(self, filter_: dict):
+        """
+        Raises an HTTPException when the filter refers to predictions, which are
+        not part of the IssueLabels documents.
+        """
+        for field in _filter_fields(filter_):
+            if field == "predictions" or field.startswith("predictions."):
+                raise ui_prediction_filter_exception(field)
+
+    def _prediction_pipeline(
+        self,
+        filter_: dict,
+        sort: list[tuple[str, int]] | None,
+        seek_filter: dict | None = None,
+    ):
+        """
+        Returns the sorted model version and the pipeline on the Predictions
+        collection that joins the matching IssueLabels documents in the sort
+        order, or None when the sort does not refer to predictions.
+        """
+        prediction_sort = [
+            field for field, _ in sort or [] if field.startswith("predictions.")
+        ]
+        if not prediction_sort:
+            return None
+        model = prediction_sort[0].split(".")[1]
+        model_id, version_id = model.split("-")
+
+        def prediction_field(field: str):
+            # Field of an IssueLabels document to the field of a Predictions one
+            if field == "_id":
+                return "issue_id"
+            return field.replace(f"predictions.{model}.", "predictions.", 1)
+
+        match = {"model_id": model_id, "version_id": version_id}
+        if seek_filter is not None:
+            match = {"$and": [match, _rename_fields(seek_filter, prediction_field)]}
+        pipeline = [
+            {"$match": match},
+            {"$sort": {prediction_field(field): order for field, order in sort}},
+            {
+                "$lookup": {
+                    "from": issue_labels_collection.name,
+                    "let": {"issue_id": "$issue_id"},
+                    "pipeline": [
+                        {
+                            "$match": {
+                                "$and": [
+                                    {"$expr": {"$eq": ["$_id", "$$issue_id"]}},
+                                    filter_,
+                                ]
+                            }
+                        },
+                        {"$project": {"predictions": 0}},
+                    ],
+                    "as": "issue",
+                }
+            },
+            # Drops the predictions of issues that do not match the filter
+            {"$unwind": "$issue"},
+        ]
+        return model, pipeline
+
+    def count_issues(self, filter_: dict, sort: list[tuple[str, int]] | None):
+        """
+        Returns the number of issues that find_issues pages over, or None when
+        that is the number of IssueLabels documents that match the filter. When
+        sorting on predictions, only the issues with predictions are counted.
+        """
+        prediction_pipeline = self._prediction_pipeline(filter_, sort)
+        if prediction_pipeline is None:
+            return None
+        _, pipeline = prediction_pipeline
+        result = list(predictions_collection.aggregate(pipeline + [{"$count": "n"}]))
+        return result[0]["n"] if result else 0
+
+    def find_issues(
+        self,
+        filter_: dict,
+        sort: list[tuple[str, int]] | None,
+        limit: int,
+        skip: int = 0,
+        seek_filter: dict | None = None,
+    ):
+        """
+        Returns a page of IssueLabels documents. When sorting on
+        predictions.<model>-<version>.<class>.confidence, the page is read from
+        the Predictions collection in index order and only the issues of the page
+        are looked up in IssueLabels. Issues without predictions of that model
+        version are then not returned.
+        """
+        prediction_pipeline = self._prediction_pipeline(filter_, sort, seek_filter)
+        if prediction_pipeline is None:
+            return _find_issue_labels(filter_, sort, limit, skip, seek_filter)
+        model, pipeline = prediction_pipeline
+        if skip:
+            pipeline.append({"$skip": skip})
+        pipeline.append({"$limit": limit})
+        issues = []
+        for result in predictions_collection.aggregate(pipeline):
+            issue = result["issue"]
+            issue["predictions"] = {model: result["predictions"]}
+            issues.append(issue)
+        return issues
+
+    def delete(self, model_id: str, version_id: str):
+        predictions_collection.delete_many(
+            {"model_id": str(model_id), "version_id": str(version_id)}
+        )
+        invalidate_issue_labels_counts()
+
+
+if PREDICTIONS_STORAGE == "collection":
+    prediction_store = CollectionPredictionStore()
+else:
+    prediction_store = EmbeddedPredictionStore()
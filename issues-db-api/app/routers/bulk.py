@@ -1,16 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
+import typing
+
+from fastapi import APIRouter, Depends, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from pymongo import UpdateOne
 from app.dependencies import issue_labels_collection, tags_collection, jira_repos_db
+from app.cache import invalidate_issue_labels_counts
+from app.encoding import media_types, negotiate_format, stream_records
 from app.routers.authentication import validate_token
+from app.util import bulk_write_in_batches, find_missing_ids, split_in_chunks
 from app.exceptions import (
     illegal_tags_insertion_exception,
     issues_not_found_exception,
     repo_not_found_exception,
-    issue_not_found_exception,
 )
 
 router = APIRouter(prefix="/bulk", tags=["bulk"])
 
+# Maximum number of ids or keys in a single $in query
+MAX_IDS_PER_QUERY = 10000
+
 
 class IssueTags(BaseModel):
     issue_id: str
@@ -21,6 +30,11 @@ class AddTagsIn(BaseModel):
     data: list[IssueTags]
 
 
+class AddTagsOut(BaseModel):
+    matched_count: int
+    modified_count: int
+
+
 class IssueKeysIn(BaseModel):
     issue_keys: list[str]
 
@@ -41,9 +55,15 @@ class TagsIn(BaseModel):
 
 class TagsOut(BaseModel):
     data: dict[str, list[str]]
+    not_found: list[str]
+
+    class Config:
+        schema_extra = {
+            "example": {"data": {"issue_id": ["tag"]}, "not_found": ["issue_id"]}
+        }
 
 
-@router.post("/add-tags")
+@router.post("/add-tags", response_model=AddTagsOut)
 def add_tags_in_bulk(request: AddTagsIn, token=Depends(validate_token)):
     """
     Method for adding tags to issues in bulk. The tags and
@@ -60,44 +80,80 @@ def add_tags_in_bulk(request: AddTagsIn, token=Depends(validate_token)):
         raise illegal_tags_insertion_exception(list(tags - allowed_tags))
 
     # Add tags
-    not_found_keys = set()
-    for issue in request.data:
-        result = issue_labels_collection.update_one(
-            {"_id": issue.issue_id}, {"$addToSet": {"tags": {"$each": issue.tags}}}
+    counts = bulk_write_in_batches(
+        issue_labels_collection,
+        (
+            UpdateOne(
+                {"_id": issue.issue_id}, {"$addToSet": {"tags": {"$each": issue.tags}}}
+            )
+            for issue in request.data
+        ),
+    )
+    invalidate_issue_labels_counts()
+    if counts["matched_count"] < len(request.data):
+        not_found_keys = find_missing_ids(
+            issue_labels_collection, [issue.issue_id for issue in request.data]
         )
-        if result.matched_count == 0:
-            not_found_keys.add(issue.issue_id)
-    if not_found_keys:
-        raise issues_not_found_exception(list(not_found_keys))
+        if not_found_keys:
+            raise issues_not_found_exception(not_found_keys)
+    return AddTagsOut(
+        matched_count=counts["matched_count"], modified_count=counts["modified_count"]
+    )
 
 
 @router.get("/get-issue-ids-from-keys", response_model=IssueIdsOut)
 def get_issue_ids_from_keys(request: IssueKeysIn):
+    repos = set(jira_repos_db.list_collection_names())
     issues = dict()
     for issue_key in request.issue_keys:
         repo = issue_key.split("-")[0]
         key = "-".join(issue_key.split("-")[1:])
-        if repo not in jira_repos_db.list_collection_names():
+        if repo not in repos:
             raise repo_not_found_exception(repo)
-        if repo not in issues:
-            issues[repo] = []
-        issues[repo].append(key)
+        issues.setdefault(repo, dict())[key] = None
 
-        # Find the ids for each repo
+    # Find the ids for each repo
     issue_ids = {}
     for repo, issue_keys in issues.items():
-        for issue_key in issue_keys:
-            issue = jira_repos_db[repo].find_one({"key": issue_key})
-            if issue is None:
-                raise issue_not_found_exception(f"{repo}-{issue_key}")
-            issue_ids[f"{repo}-{issue_key}"] = f'{repo}-{issue["id"]}'
+        for keys in split_in_chunks(list(issue_keys), MAX_IDS_PER_QUERY):
+            for issue in jira_repos_db[repo].find(
+                {"key": {"$in": keys}}, ["id", "key"]
+            ):
+                issue_ids[f'{repo}-{issue["key"]}'] = f'{repo}-{issue["id"]}'
+    not_found_keys = [
+        f"{repo}-{issue_key}"
+        for repo, issue_keys in issues.items()
+        for issue_key in issue_keys
+        if f"{repo}-{issue_key}" not in issue_ids
+    ]
+    if not_found_keys:
+        raise issues_not_found_exception(not_found_keys)
     return IssueIdsOut(issue_ids=issue_ids)
 
 
+def stream_tags(issue_ids: list[str], stream_format: str):
+    remaining_ids = dict.fromkeys(issue_ids)
+
+    def records():
+        for ids in split_in_chunks(list(remaining_ids), MAX_IDS_PER_QUERY):
+            for issue in issue_labels_collection.find({"_id": {"$in": ids}}, ["tags"]):
+                del remaining_ids[issue["_id"]]
+                yield issue["_id"], issue["tags"]
+
+    return stream_records(
+        records(), stream_format, trailer=lambda: {"not_found": list(remaining_ids)}
+    )
+
+
 @router.get("/tags", response_model=TagsOut)
-def get_tags(request: TagsIn):
-    data = {}
-    for issue_id in request.issue_ids:
-        issue = issue_labels_collection.find_one({"_id": issue_id}, ["tags"])
-        data[issue_id] = issue["tags"]
-    return {"data": data}
+def get_tags(request: TagsIn, accept: typing.Annotated[str | None, Header()] = None):
+    """
+    Returns the tags of the given issues as a stream. Issues that do not exist
+    are listed in not_found. Send "Accept: application/x-ndjson" to get one
+    issue per line, followed by a line with the not_found list.
+    """
+    stream_format = negotiate_format(accept)
+    return StreamingResponse(
+        stream_tags(request.issue_ids, stream_format),
+        media_type=media_types[stream_format],
+    )
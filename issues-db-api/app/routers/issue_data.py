@@ -1,10 +1,12 @@
 import typing
-import json
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from app.dependencies import jira_repos_db, repo_info_collection
+from app.encoding import JSON, media_types, negotiate_format, stream_records
+from app.util import split_in_chunks, prefetch_in_order
 from app.exceptions import (
+    repo_not_found_exception,
     get_attr_required_exception,
     duplicate_issue_exception,
     attribute_not_found_exception,
@@ -13,6 +15,11 @@ from app.exceptions import (
 
 router = APIRouter(prefix="/issue-data", tags=["issue-data"])
 
+# Maximum number of ids in a single $in query
+MAX_IDS_PER_QUERY = 10000
+# Number of $in queries that run concurrently
+FETCH_WORKERS = 8
+
 default_value = {
     "summary": "",
     "description": "",
@@ -48,105 +55,179 @@ class IssueDataOut(BaseModel):
         }
 
 
-def streaming_issue_data(request: IssueDataIn):
-    yield '{"data": {'
-    # Collect the ids belonging to each Jira repo
+def _group_ids_by_repo(issue_ids: list[str]):
+    # Collect the ids belonging to each Jira repo, in order of appearance
     ids = dict()
-    for jira_name in jira_repos_db.list_collection_names():
-        ids[jira_name] = []
-    for issue_id in request.issue_ids:
+    for issue_id in issue_ids:
         split_id = issue_id.split("-")
         # First part is the jira repo name, second part is the id
-        ids[split_id[0]].append(split_id[1])
-
-    first_item = True
-    for jira_name in jira_repos_db.list_collection_names():
-        issues = jira_repos_db[jira_name].find(
-            {"id": {"$in": ids[jira_name]}},
-            ["id", "key"]
-            + [
-                f"fields.{attr}"
-                for attr in request.attributes
-                if attr not in ["key", "link"]
-            ],
+        ids.setdefault(split_id[0], dict())[split_id[1]] = None
+    existing_repos = set(jira_repos_db.list_collection_names())
+    for jira_name in ids:
+        if jira_name not in existing_repos:
+            raise repo_not_found_exception(jira_name)
+    return {jira_name: list(repo_ids) for jira_name, repo_ids in ids.items()}
+
+
+def _fetch_task(jira_name: str, ids: list[str], projection: list[str]):
+    def fetch():
+        return list(jira_repos_db[jira_name].find({"id": {"$in": ids}}, projection))
+
+    return fetch
+
+
+def fetch_repo_issues(ids: dict[str, list[str]], projection: list[str]):
+    """
+    Fetches the issues of each repo in bounded $in chunks. The chunks are
+    queried concurrently, but yielded as (jira_name, issues, is_last_chunk)
+    in the order of the repos and chunks.
+    """
+    chunks = []
+    for jira_name, repo_ids in ids.items():
+        repo_chunks = list(split_in_chunks(repo_ids, MAX_IDS_PER_QUERY))
+        for idx, chunk in enumerate(repo_chunks):
+            chunks.append((jira_name, chunk, idx == len(repo_chunks) - 1))
+    results = prefetch_in_order(
+        (_fetch_task(jira_name, chunk, projection) for jira_name, chunk, _ in chunks),
+        FETCH_WORKERS,
+    )
+    for (jira_name, _, is_last_chunk), issues in zip(chunks, results):
+        yield jira_name, issues, is_last_chunk
+
+
+def _issuelinks(jira_name: str, issuelinks: list):
+    for issuelink in issuelinks:
+        if "outwardIssue" in issuelink:
+            issuelink["outwardIssue"] = f'{jira_name}-{issuelink["outwardIssue"]["id"]}'
+        if "inwardIssue" in issuelink:
+            issuelink["inwardIssue"] = f'{jira_name}-{issuelink["inwardIssue"]["id"]}'
+    return issuelinks
+
+
+def _parent(jira_name: str, parent: dict):
+    return f'{jira_name}-{parent["id"]}'
+
+
+def _subtasks(jira_name: str, subtasks: list):
+    return [f'{jira_name}-{subtask["id"]}' for subtask in subtasks]
+
+
+def _identity(jira_name: str, value):
+    return value
+
+
+# Conversions applied to attribute values that exist
+value_converters = {
+    "issuelinks": _issuelinks,
+    "parent": _parent,
+    "subtasks": _subtasks,
+}
+
+
+def _key_extractor(jira_name: str, issue: dict):
+    if issue["key"] is None:
+        raise get_attr_required_exception("key", f'{jira_name}-{issue["id"]}')
+    return issue["key"]
+
+
+def _link_extractor(issue_link_prefixes: dict[str, str]):
+    def extract(jira_name: str, issue: dict):
+        return f'{issue_link_prefixes.get(jira_name)}/browse/{issue["key"]}'
+
+    return extract
+
+
+def _field_extractor(attr: str):
+    convert = value_converters.get(attr, _identity)
+    has_default = attr in default_value
+    default = default_value.get(attr)
+
+    def extract(jira_name: str, issue: dict):
+        fields = issue["fields"]
+        if attr not in fields:
+            if attr == "parent":
+                return None
+            raise attribute_not_found_exception(attr, jira_name, issue["id"])
+        value = fields[attr]
+        if value is not None:
+            return convert(jira_name, value)
+        if not has_default:
+            # Attribute does not exist, but is required
+            raise get_attr_required_exception(attr, f'{jira_name}-{issue["id"]}')
+        return default
+
+    return extract
+
+
+def compile_attribute_plan(
+    attributes: list[str], issue_link_prefixes: dict[str, str]
+) -> list[tuple[str, typing.Callable[[str, dict], typing.Any]]]:
+    """
+    Turns the requested attributes into a list of (attribute, extractor) pairs.
+    Every extractor takes the jira name and the issue, so the attribute checks
+    are done once per request instead of once per issue.
+    """
+    plan = []
+    for attr in attributes:
+        if attr == "key":
+            plan.append((attr, _key_extractor))
+        elif attr == "link":
+            plan.append((attr, _link_extractor(issue_link_prefixes)))
+        else:
+            plan.append((attr, _field_extractor(attr)))
+    return plan
+
+
+def issue_data_records(request: IssueDataIn, ids: dict[str, list[str]]):
+    projection = ["id", "key"] + [
+        f"fields.{attr}" for attr in request.attributes if attr not in ["key", "link"]
+    ]
+    issue_link_prefixes = {
+        repo_info["_id"]: repo_info["issue_link_prefix"]
+        for repo_info in repo_info_collection.find(
+            {"_id": {"$in": list(ids)}}, ["issue_link_prefix"]
         )
+    }
+    plan = compile_attribute_plan(request.attributes, issue_link_prefixes)
 
-        issue_link_prefix = None
-        remaining_ids = set(ids[jira_name])
+    remaining_ids = None
+    for jira_name, issues, is_last_chunk in fetch_repo_issues(ids, projection):
+        if remaining_ids is None:
+            remaining_ids = set(ids[jira_name])
         for issue in issues:
-            if issue_link_prefix is None:
-                issue_link_prefix = repo_info_collection.find_one({"_id": jira_name})[
-                    "issue_link_prefix"
-                ]
             if issue["id"] not in remaining_ids:
                 raise duplicate_issue_exception(jira_name, issue["id"])
             remaining_ids.remove(issue["id"])
-            attributes = {}
-            for attr in request.attributes:
-                if attr == "key":
-                    if issue[attr] is None:
-                        raise get_attr_required_exception(
-                            attr, f'{jira_name}-{issue["id"]}'
-                        )
-                    attributes[attr] = issue[attr]
-                elif attr == "link":
-                    attributes[attr] = f'{issue_link_prefix}/browse/{issue["key"]}'
-                elif attr not in issue["fields"]:
-                    if attr == "parent":
-                        attributes[attr] = None
-                    else:
-                        raise attribute_not_found_exception(
-                            attr, jira_name, issue["id"]
-                        )
-                elif issue["fields"][attr] is not None:
-                    # Attribute exists
-                    if attr in "issuelinks":
-                        issuelinks = issue["fields"][attr]
-                        for idx in range(len(issuelinks)):
-                            if "outwardIssue" in issuelinks[idx]:
-                                issuelinks[idx][
-                                    "outwardIssue"
-                                ] = f'{jira_name}-{issuelinks[idx]["outwardIssue"]["id"]}'
-                            if "inwardIssue" in issuelinks[idx]:
-                                issuelinks[idx][
-                                    "inwardIssue"
-                                ] = f'{jira_name}-{issuelinks[idx]["inwardIssue"]["id"]}'
-                        attributes[attr] = issuelinks
-                    elif attr == "parent":
-                        attributes[attr] = f'{jira_name}-{issue["fields"][attr]["id"]}'
-                    elif attr == "subtasks":
-                        subtasks = []
-                        for subtask in issue["fields"][attr]:
-                            subtasks.append(f'{jira_name}-{subtask["id"]}')
-                        attributes[attr] = subtasks
-                    else:
-                        attributes[attr] = issue["fields"][attr]
-                elif attr not in list(default_value.keys()):
-                    # Attribute does not exist, but is required
-                    raise get_attr_required_exception(
-                        attr, f'{jira_name}-{issue["id"]}'
-                    )
-                else:
-                    # Use default value for attribute
-                    attributes[attr] = default_value[attr]
-            if first_item:
-                yield f'"{jira_name}-{issue["id"]}": {json.dumps(attributes)}'
-                first_item = False
-            else:
-                yield f',"{jira_name}-{issue["id"]}": {json.dumps(attributes)}'
+            attributes = {attr: extractor(jira_name, issue) for attr, extractor in plan}
+            yield f'{jira_name}-{issue["id"]}', attributes
+        if not is_last_chunk:
+            continue
         if remaining_ids:
             raise issues_not_found_exception(
                 [f"{jira_name}-{id_}" for id_ in remaining_ids]
             )
-    yield "}}"
+        remaining_ids = None
+
+
+def streaming_issue_data(
+    request: IssueDataIn, ids: dict[str, list[str]], stream_format: str = JSON
+):
+    return stream_records(issue_data_records(request, ids), stream_format)
 
 
 @router.get("", response_model=IssueDataOut)
-def get_issue_data(request: IssueDataIn):
+def get_issue_data(
+    request: IssueDataIn, accept: typing.Annotated[str | None, Header()] = None
+):
     """
     Returns issue data. The returned data is determined by the
     specified issue ids and the attributes that are requested.
+    Send "Accept: application/x-ndjson" to get one issue per line, or
+    "Accept: application/msgpack" to get a stream of MessagePack objects.
     """
+    stream_format = negotiate_format(accept)
+    ids = _group_ids_by_repo(request.issue_ids)
     return StreamingResponse(
-        streaming_issue_data(request), media_type="text/event-stream"
+        streaming_issue_data(request, ids, stream_format),
+        media_type=media_types[stream_format],
     )
@@ -1,4 +1,5 @@
 from app.dependencies import issue_labels_collection, tags_collection
+from app.cache import invalidate_issue_labels_counts
 from app.exceptions import (
     issue_not_found_exception,
     illegal_tag_insertion_exception,
@@ -26,6 +27,7 @@ def _update_manual_label(issue_id: str, update: dict):
         {"_id": issue_id},
         update,
     )
+    invalidate_issue_labels_counts()
     if result.matched_count == 0:
         raise issue_not_found_exception(issue_id)
 
@@ -60,6 +62,7 @@ def add_tag(issue_id: str, request: Tag, token=Depends(validate_token)):
         {"_id": issue_id, "tags": {"$ne": request.tag}},
         {"$addToSet": {"tags": request.tag}},
     )
+    invalidate_issue_labels_counts()
     if result.modified_count == 0:
         if issue_labels_collection.find_one({"_id": issue_id}) is None:
             raise issue_not_found_exception(issue_id)
@@ -72,6 +75,7 @@ def delete_tag(issue_id: str, tag: str, token=Depends(validate_token)):
     result = issue_labels_collection.update_one(
         {"_id": issue_id, "tags": tag}, {"$pull": {"tags": tag}}
     )
+    invalidate_issue_labels_counts()
     if result.modified_count == 0:
         if issue_labels_collection.find_one({"_id": issue_id}) is None:
             raise issue_not_found_exception(issue_id)
@@ -1,4 +1,4 @@
-from app.dependencies import repo_info_collection
+from app.dependencies import create_jira_repo_indexes, repo_info_collection
 from app.exceptions import (
     repo_exists_exception,
     repo_not_exists_exception,
@@ -6,8 +6,15 @@ from app.exceptions import (
     wrong_batch_size,
     wrong_wait_time,
 )
-from app.jirarepos_download import download_multiprocessed
+from app.jirarepos_download import (
+    download_multiprocessed,
+    download_concurrently,
+    get_query,
+    get_search_options,
+)
+from app.jobs import submit_job
 from app.routers.authentication import validate_token
+from app.routers.jobs import JobIdOut
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from datetime import date
@@ -28,7 +35,11 @@ class Repo(BaseModel):
     repo_url: str
     download_date: str | None
     batch_size: int
+    # Seconds between two search requests of the repo. The name is kept for the
+    # repos that are already stored.
     query_wait_time_minutes: float
+    fields: list[str] | None = None
+    changelog: bool = True
 
 
 class RepoUpdate(BaseModel):
@@ -36,10 +47,38 @@ class RepoUpdate(BaseModel):
     download_date: str | None
     batch_size: int
     query_wait_time_minutes: float
+    fields: list[str] | None = None
+    changelog: bool = True
+
+
+def download_repo(repo_info, request, job=None, rate_limiter=None):
+    query = get_query(repo_info["download_date"])
+    checkpoint = repo_info.get("checkpoint")
+    if checkpoint is not None and checkpoint["query"] == query:
+        # Resume an interrupted download, keeping the date on which it started
+        start_index = checkpoint["start_at"]
+        download_date = checkpoint["download_date"]
+        print(f"Resuming download of {repo_info['_id']} at {start_index}")
+    else:
+        start_index = 0
+        download_date = str(date.today())
+
+    def save_checkpoint(start_at):
+        repo_info_collection.update_one(
+            {"_id": repo_info["_id"]},
+            {
+                "$set": {
+                    "checkpoint": {
+                        "query": query,
+                        "start_at": start_at,
+                        "download_date": download_date,
+                    }
+                }
+            },
+        )
 
-
-def download_repo(repo_info, request):
-    download_date = date.today()
+    # Indexed before the first upsert, also when the repo is new
+    create_jira_repo_indexes(repo_info["_id"])
     download_multiprocessed(
         repo_info["_id"],
         repo_info["repo_url"],
@@ -49,10 +88,17 @@ def download_repo(repo_info, request):
         enable_auth=request.enable_auth,
         username=request.username,
         password=request.password,
+        start_index=start_index,
+        job=job,
+        rate_limiter=rate_limiter,
+        save_checkpoint=save_checkpoint,
+        search_options=get_search_options(
+            repo_info.get("fields"), repo_info.get("changelog", True)
+        ),
     )
     repo_info_collection.update_one(
         {"_id": repo_info["_id"]},
-        {"$set": {"download_date": str(download_date)}},
+        {"$set": {"download_date": download_date}, "$unset": {"checkpoint": ""}},
     )
 
 
@@ -68,7 +114,16 @@ def validate_repo_info(request):
         raise wrong_wait_time(request.query_wait_time_minutes)
 
 
-@router.post("-download")
+def download_repos(job, repo_infos, request):
+    download_concurrently(
+        repo_infos,
+        lambda repo_info, rate_limiter: download_repo(
+            repo_info, request, job, rate_limiter
+        ),
+    )
+
+
+@router.post("-download", response_model=JobIdOut)
 def jira_repos_download(request: RequestIn, token=Depends(validate_token)):
     """
     Endpoint for downloading or updating the issue data from JiraRepos. When setting
@@ -77,20 +132,23 @@ def jira_repos_download(request: RequestIn, token=Depends(validate_token)):
     is a repo name. In this case, the endpoint only updates the issue data from the
     specified repos. Optionally, authentication can be used for updating certain repos.
     In this case, only specify the repos for which the authentication credentials are
-    valid.
+    valid. The download runs as a job, use /jobs/{job_id} to follow its progress.
+    Repos on different Jira servers are downloaded in parallel.
     :param token:
     :param request:
     :return:
     """
     if request.repos is None:
-        for repo_info in repo_info_collection.find({}):
-            download_repo(repo_info, request)
+        repo_infos = list(repo_info_collection.find({}))
     else:
+        repo_infos = []
         for repo in request.repos:
             repo_info = repo_info_collection.find_one({"_id": repo})
             if repo_info is None:
                 raise repo_not_exists_exception(repo)
-            download_repo(repo_info, request)
+            repo_infos.append(repo_info)
+    job_id = submit_job("jira-repos-download", download_repos, repo_infos, request)
+    return JobIdOut(job_id=job_id)
 
 
 @router.get("", response_model=list[Repo])
@@ -109,6 +167,8 @@ def get_repo_info():
                 download_date=repo["download_date"],
                 batch_size=repo["batch_size"],
                 query_wait_time_minutes=repo["query_wait_time_minutes"],
+                fields=repo.get("fields"),
+                changelog=repo.get("changelog", True),
             )
         )
     return response
@@ -118,7 +178,9 @@ def get_repo_info():
 def add_repo(request: Repo, token=Depends(validate_token)):
     """
     Add the information about a repo, so the jira-repos-download endpoint can download
-    issue data from the repo.
+    issue data from the repo. The download can be limited to the given fields (the
+    fields that the API itself reads are always downloaded), and the changelog can
+    be left out.
     :param request:
     :param token:
     :return:
@@ -133,6 +195,8 @@ def add_repo(request: Repo, token=Depends(validate_token)):
             "download_date": request.download_date,
             "batch_size": request.batch_size,
             "query_wait_time_minutes": request.query_wait_time_minutes,
+            "fields": request.fields,
+            "changelog": request.changelog,
         }
     )
 
@@ -155,6 +219,8 @@ def update_repo(repo_name: str, request: RepoUpdate, token=Depends(validate_toke
                 "download_date": request.download_date,
                 "batch_size": request.batch_size,
                 "query_wait_time_minutes": request.query_wait_time_minutes,
+                "fields": request.fields,
+                "changelog": request.changelog,
             }
         },
     )
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from app.dependencies import jobs_collection
+from app.exceptions import job_not_found_exception, job_finished_exception
+from app.jobs import FINISHED_STATUSES
+from app.routers.authentication import validate_token
+from bson import ObjectId
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+class JobIdOut(BaseModel):
+    job_id: str
+
+
+class JobOut(BaseModel):
+    job_id: str
+    name: str
+    status: str
+    total: int
+    done: int
+    progress: float | None
+    throughput: float | None
+    eta_seconds: float | None
+    error: str | None
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+
+
+def _find_job(job_id: str):
+    job = None
+    if ObjectId.is_valid(job_id):
+        job = jobs_collection.find_one({"_id": ObjectId(job_id)})
+    if job is None:
+        raise job_not_found_exception(job_id)
+    return job
+
+
+def _job_out(job) -> JobOut:
+    progress = None
+    if job["total"] > 0:
+        progress = min(job["done"] / job["total"], 1.0)
+
+    # Throughput in items per second since the job started
+    throughput = None
+    eta_seconds = None
+    if job["started_at"] is not None:
+        end = job["finished_at"] or datetime.utcnow()
+        elapsed = (end - job["started_at"]).total_seconds()
+        if elapsed > 0:
+            throughput = job["done"] / elapsed
+        if job["status"] == "running" and throughput:
+            eta_seconds = max(job["total"] - job["done"], 0) / throughput
+
+    return JobOut(
+        job_id=str(job["_id"]),
+        name=job["name"],
+        status=job["status"],
+        total=job["total"],
+        done=job["done"],
+        progress=progress,
+        throughput=throughput,
+        eta_seconds=eta_seconds,
+        error=job["error"],
+        created_at=job["created_at"],
+        started_at=job["started_at"],
+        finished_at=job["finished_at"],
+    )
+
+
+@router.get("", response_model=list[JobOut])
+def get_jobs():
+    """
+    Returns all jobs, most recent first.
+    """
+    jobs = jobs_collection.find({}).sort("created_at", -1)
+    return [_job_out(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=JobOut)
+def get_job(job_id: str):
+    """
+    Returns the status of a job. Progress is the fraction of the total work that is
+    done, throughput is in items per second and eta_seconds estimates the remaining
+    time of a running job.
+    """
+    return _job_out(_find_job(job_id))
+
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: str, token=Depends(validate_token)):
+    """
+    Requests the cancellation of a job. Running jobs stop at their next progress
+    update, pending jobs are not started.
+    """
+    job = _find_job(job_id)
+    result = jobs_collection.update_one(
+        {"_id": job["_id"], "status": {"$nin": list(FINISHED_STATUSES)}},
+        {"$set": {"cancel_requested": True}},
+    )
+    if result.matched_count == 0:
+        raise job_finished_exception(job_id, job["status"])
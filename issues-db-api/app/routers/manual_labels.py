@@ -1,6 +1,7 @@
 import typing
 
 from app.dependencies import issue_labels_collection
+from app.cache import invalidate_issue_labels_counts
 from app.exceptions import (
     issue_not_found_exception,
     manual_labels_not_found_exception,
@@ -68,6 +69,7 @@ def _update_comment(issue_id: str, comment_id: str, username: str, update: dict)
         },
         update,
     )
+    invalidate_issue_labels_counts()
     if result.modified_count != 1:
         issue = issue_labels_collection.find_one({"_id": issue_id})
         if issue is None:
@@ -167,6 +169,7 @@ def update_manual_label(issue_id: str, request: Label, token=Depends(validate_to
             "$addToSet": {"tags": {"$each": ["has-label", token["username"]]}},
         },
     )
+    invalidate_issue_labels_counts()
     if result.matched_count == 0:
         raise issue_not_found_exception(issue_id)
     ui_updates.send_ui_update_manual_label(issue_id)
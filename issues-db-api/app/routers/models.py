@@ -1,25 +1,51 @@
 import io
 import json
+import shutil
+import tempfile
 import typing
 
 import bson
+from app.encoding import JSON, media_types, negotiate_format, stream_records
 from app.dependencies import fs, models_collection, issue_labels_collection
+from app.predictions import prediction_store
 from app.exceptions import (
     model_not_found_exception,
     version_not_found_exception,
     performance_not_found_exception,
-    issue_not_found_exception,
+    issues_not_found_exception,
     bson_exception,
+    wrong_batch_size,
 )
+from app.jobs import submit_job
 from app.routers.authentication import validate_token
-from app.util import read_file_in_chunks
+from app.routers.jobs import JobIdOut
+from app.util import (
+    read_file_in_chunks,
+    iter_batches,
+    find_missing_ids,
+    BULK_WRITE_BATCH_SIZE,
+)
 from bson import ObjectId
-from fastapi import APIRouter, UploadFile, Form, Depends, HTTPException
+from fastapi import (
+    APIRouter,
+    UploadFile,
+    Form,
+    Depends,
+    Header,
+    HTTPException,
+)
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 router = APIRouter(prefix="/models", tags=["models"])
 
+NDJSON_CONTENT_TYPES = ["application/x-ndjson", "application/ndjson"]
+
 
 class PostModelIn(BaseModel):
     model_config: dict
@@ -100,6 +126,7 @@ class PostPredictionsIn(BaseModel):
 
 class GetPredictionsIn(BaseModel):
     issue_ids: list[str] | None
+    batch_size: int = 1000
 
 
 class GetPredictionsOut(BaseModel):
@@ -146,17 +173,7 @@ def _update_model(model_id: str, update: dict):
 
 
 def _delete_predictions(model_id: str, version_id: ObjectId):
-    # Remove predictions
-    issue_labels_collection.update_many(
-        {}, {"$unset": {f"predictions.{model_id}-{version_id}": ""}}
-    )
-    # Remove indexes
-    indexes = issue_labels_collection.index_information()
-    for key, value in indexes.items():
-        for col in value["key"]:
-            if f"predictions.{model_id}-{version_id}" in col[0]:
-                issue_labels_collection.drop_index(key)
-                break
+    prediction_store.delete(model_id, version_id)
 
 
 def _delete_version(model_id: str, version_id: ObjectId):
@@ -165,6 +182,13 @@ def _delete_version(model_id: str, version_id: ObjectId):
     _delete_predictions(model_id, version_id)
 
 
+def _delete_versions_job(job, model_id: str, version_ids: list[ObjectId]):
+    job.add_total(len(version_ids))
+    for version_id in version_ids:
+        _delete_version(model_id, version_id)
+        job.advance()
+
+
 @router.get("", response_model=GetModelsOut)
 def get_all_models():
     """
@@ -219,18 +243,23 @@ def update_model(model_id: str, request: UpdateModelIn, token=Depends(validate_t
     _update_model(model_id, {"$set": updated_info})
 
 
-@router.delete("/{model_id}")
+@router.delete("/{model_id}", response_model=JobIdOut)
 def delete_model(model_id: str, token=Depends(validate_token)):
-    model = models_collection.find_one({"_id": ObjectId(model_id)})
+    """
+    Deletes the model, including performances. Its versions and their predictions
+    are deleted by a job.
+    """
+    model = models_collection.find_one_and_delete({"_id": ObjectId(model_id)})
     if model is None:
         raise model_not_found_exception(model_id)
 
-    # Delete versions and their predictions
-    for version_id in model["versions"]:
-        _delete_version(model_id, ObjectId(version_id))
-
-    # Delete the model itself, including performances
-    models_collection.delete_one({"_id": ObjectId(model_id)})
+    job_id = submit_job(
+        "delete-model",
+        _delete_versions_job,
+        model_id,
+        [ObjectId(version_id) for version_id in model["versions"]],
+    )
+    return JobIdOut(job_id=job_id)
 
 
 @router.post("/{model_id}/versions", response_model=VersionIdOut)
@@ -294,7 +323,7 @@ def replace_model_version_file(
     fs.put(file.file, _id=ObjectId(version_id), filename=file.filename)
 
 
-@router.delete("/{model_id}/versions/{version_id}")
+@router.delete("/{model_id}/versions/{version_id}", response_model=JobIdOut)
 def delete_model_version(model_id: str, version_id: str, token=Depends(validate_token)):
     result = models_collection.update_one(
         {"_id": ObjectId(model_id)}, {"$unset": {f"versions.{version_id}": ""}}
@@ -303,7 +332,10 @@ def delete_model_version(model_id: str, version_id: str, token=Depends(validate_
         raise model_not_found_exception(model_id)
     if result.modified_count == 0:
         raise version_not_found_exception(version_id, model_id)
-    _delete_version(model_id, ObjectId(version_id))
+    job_id = submit_job(
+        "delete-model-version", _delete_versions_job, model_id, [ObjectId(version_id)]
+    )
+    return JobIdOut(job_id=job_id)
 
 
 @router.put("/{model_id}/versions/{version_id}/description")
@@ -321,7 +353,63 @@ def update_version_description(
         raise version_not_found_exception(version_id, model_id)
 
 
-@router.post("/{model_id}/versions/{version_id}/predictions")
+def _is_ndjson(file: UploadFile) -> bool:
+    return file.content_type in NDJSON_CONTENT_TYPES or (
+        file.filename is not None and file.filename.endswith(".ndjson")
+    )
+
+
+def _read_predictions(file: typing.BinaryIO, ndjson: bool):
+    """
+    Yields (issue_id, predicted_classes) from an uploaded predictions file without
+    loading the whole file. NDJSON files contain one
+    {"issue_id": ..., "predictions": {...}} object per line, other files are parsed
+    incrementally as a {"predictions": {...}} object.
+    """
+    if ndjson:
+        for line in file:
+            if line.strip():
+                prediction = json.loads(line)
+                yield prediction["issue_id"], prediction["predictions"]
+    elif ijson is not None:
+        yield from ijson.kvitems(file, "predictions", use_float=True)
+    else:
+        yield from json.load(file)["predictions"].items()
+
+
+def _post_predictions_job(
+    job, model_id: str, version_id: str, file: typing.BinaryIO, ndjson: bool
+):
+    with file:
+        classes = set()
+        unmatched_ids = []
+        for batch in iter_batches(
+            _read_predictions(file, ndjson), BULK_WRITE_BATCH_SIZE
+        ):
+            # The size of the upload is only known once it has been read
+            job.add_total(len(batch))
+            predictions = []
+            for issue_id, predicted_classes in batch:
+                issue_predictions = {}
+                for predicted_class, prediction in predicted_classes.items():
+                    issue_predictions[predicted_class] = {
+                        "prediction": prediction["prediction"],
+                        "confidence": float(prediction["confidence"]),
+                    }
+                    classes.add(predicted_class)
+                predictions.append((issue_id, issue_predictions))
+            unmatched_ids.extend(
+                prediction_store.write(model_id, version_id, predictions)
+            )
+            job.advance(len(batch))
+
+    prediction_store.create_indexes(model_id, version_id, classes)
+    missing_ids = find_missing_ids(issue_labels_collection, unmatched_ids)
+    if missing_ids:
+        raise issues_not_found_exception(missing_ids)
+
+
+@router.post("/{model_id}/versions/{version_id}/predictions", response_model=JobIdOut)
 def post_predictions(
     model_id: str,
     version_id: str,
@@ -329,83 +417,92 @@ def post_predictions(
     token=Depends(validate_token),
 ):
     """
-    Saves the predictions of the specified model version in the database. Predictions
-    should have the following format:
+    Starts a job that saves the predictions of the specified model version in the
+    database. Predictions should have the following format:
     {
         "predictions": {
             "issue_id": {"existence": {"prediction": True, "confidence": 0.42}}
         }
     }
+    Large uploads can also be sent as NDJSON (a .ndjson file or an
+    application/x-ndjson part), with one line per issue:
+    {"issue_id": "issue_id", "predictions": {"existence": {"prediction": true, ...}}}
+    The job reports the number of saved issues as its progress and fails when
+    issues do not exist.
     """
     # Make sure the version of the model exists
     model = _get_model(model_id, ["versions"])
     if version_id not in model["versions"]:
         raise version_not_found_exception(version_id, model_id)
-    # Convert file to json
-    predictions = json.loads(file.file.read().decode("utf-8"))["predictions"]
-    classes = set()
-    for issue_id, predicted_classes in predictions.items():
-        predictions = {}
-        for predicted_class in predicted_classes:
-            predictions[predicted_class] = {
-                "prediction": predicted_classes[predicted_class]["prediction"],
-                "confidence": predicted_classes[predicted_class]["confidence"],
-            }
-            classes.add(predicted_class)
-        result = issue_labels_collection.update_one(
-            {"_id": issue_id},
-            {"$set": {f"predictions.{model_id}-{version_id}": predictions}},
-        )
-        if result.matched_count != 1:
-            raise issue_not_found_exception(issue_id)
-    for class_ in classes:
-        # Make sure the predictions are indexed for speed
-        issue_labels_collection.create_index(
-            f"predictions.{model_id}-{version_id}.{class_}.confidence"
-        )
+
+    # The upload is closed once the response is sent, so the job reads a copy
+    upload = tempfile.TemporaryFile()
+    shutil.copyfileobj(file.file, upload)
+    upload.seek(0)
+    job_id = submit_job(
+        "post-predictions",
+        _post_predictions_job,
+        model_id,
+        version_id,
+        upload,
+        _is_ndjson(file),
+    )
+    return JobIdOut(job_id=job_id)
+
+
+def _prediction_records(model_id: str, version_id: str, request: GetPredictionsIn):
+    remaining_ids = None
+    if request.issue_ids is not None:
+        remaining_ids = set(request.issue_ids)
+    for issue_id, predictions in prediction_store.find(
+        model_id, version_id, request.issue_ids, request.batch_size
+    ):
+        if remaining_ids is not None:
+            remaining_ids.discard(issue_id)
+        yield issue_id, predictions
+    if remaining_ids is not None:
+        for issue_id in remaining_ids:
+            yield issue_id, None
 
 
 @router.get("/{model_id}/versions/{version_id}/predictions")
-def get_predictions(model_id: str, version_id: str, request: GetPredictionsIn):
+def get_predictions(
+    model_id: str,
+    version_id: str,
+    request: GetPredictionsIn,
+    accept: typing.Annotated[str | None, Header()] = None,
+):
     """
     Returns the predicted labels of the specified model version. Set issue_ids to null
-    to get all predictions. It returns the predictions as a byte stream.
+    to get all predictions. It returns the predictions as a byte stream, read from the
+    database in batches of batch_size issues. Send "Accept: application/x-ndjson" to
+    get one {"issue_id": ..., "predictions": ...} object per line.
     """
-    if request.issue_ids is None:
-        filter_ = {f"predictions.{model_id}-{version_id}": {"$exists": True}}
-    else:
-        filter_ = {
-            "$and": [
-                {"_id": {"$in": request.issue_ids}},
-                {f"predictions.{model_id}-{version_id}": {"$exists": True}},
-            ]
-        }
-    issues = issue_labels_collection.find(
-        filter_, [f"predictions.{model_id}-{version_id}"]
-    )
-    predictions = dict()
-    if request.issue_ids is not None:
-        remaining_ids = set(request.issue_ids)
-    for issue in issues:
-        issue_id = issue.pop("_id")
-        predictions[issue_id] = issue["predictions"][f"{model_id}-{version_id}"]
-        if request.issue_ids is not None:
-            remaining_ids.remove(issue_id)
-    if request.issue_ids is not None:
-        for issue_id in remaining_ids:
-            predictions[issue_id] = None
-    file = io.BytesIO(bytes(json.dumps({"predictions": predictions}), "utf-8"))
+    if request.batch_size <= 0:
+        raise wrong_batch_size(request.batch_size)
+    stream_format = negotiate_format(accept)
+    media_type = media_types[stream_format]
+    if stream_format == JSON:
+        media_type = "application/octet-stream"
     return StreamingResponse(
-        read_file_in_chunks(file), media_type="application/octet-stream"
+        stream_records(
+            _prediction_records(model_id, version_id, request),
+            stream_format,
+            field="predictions",
+        ),
+        media_type=media_type,
     )
 
 
-@router.delete("/{model_id}/versions/{version_id}/predictions")
+@router.delete("/{model_id}/versions/{version_id}/predictions", response_model=JobIdOut)
 def delete_predictions(model_id: str, version_id: str, token=Depends(validate_token)):
     model = _get_model(model_id, ["versions"])
     if version_id not in model["versions"]:
         raise version_not_found_exception(version_id, model_id)
-    _delete_version(model_id, ObjectId(version_id))
+    job_id = submit_job(
+        "delete-predictions", _delete_versions_job, model_id, [ObjectId(version_id)]
+    )
+    return JobIdOut(job_id=job_id)
 
 
 @router.post("/{model_id}/performances", response_model=PostPerformanceOut)
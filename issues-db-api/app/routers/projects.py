@@ -1,5 +1,8 @@
+from app.cache import invalidate_issue_labels_counts
 from app.dependencies import jira_repos_db, projects_collection, issue_labels_collection
+from app.jobs import submit_job
 from app.routers.authentication import validate_token
+from app.routers.jobs import JobIdOut
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from app.util import insert_one, find_one, update_one, delete_one
@@ -17,10 +20,14 @@ class AdditionalProperties(BaseModel):
     additional_properties: dict[str, str | list[str]]
 
 
-def fix_tags():
+def fix_tags(job):
     tags_per_project = {}
     tags_to_remove = set()
 
+    # Every issue is visited twice
+    for ecosystem in jira_repos_db.list_collection_names():
+        job.add_total(2 * jira_repos_db[ecosystem].estimated_document_count())
+
     # Get current projects
     for project in projects_collection.find({}):
         tags = get_tags(project)
@@ -41,6 +48,7 @@ def fix_tags():
                 projects_collection.insert_one(project)
                 tags_per_project[f"{ecosystem}-{key}"] = get_tags(project)
                 tags_to_remove = tags_to_remove.union(set(get_tags(project)))
+            job.advance()
 
     # Remove old tags first
     issue_labels_collection.update_many(
@@ -59,6 +67,8 @@ def fix_tags():
                     }
                 },
             )
+            job.advance()
+    invalidate_issue_labels_counts()
 
 
 def get_tags(project):
@@ -81,6 +91,7 @@ def delete_tags(project):
         {"tags": f"{project['ecosystem']}-{project['key']}"},
         {"$pull": {"tags": {"$in": tags}}},
     )
+    invalidate_issue_labels_counts()
 
 
 def add_tags(project):
@@ -93,6 +104,16 @@ def add_tags(project):
         {"tags": f"{project['ecosystem']}-{project['key']}"},
         {"$addToSet": {"tags": {"$each": tags}}},
     )
+    invalidate_issue_labels_counts()
+
+
+@router.post("/fix-tags", response_model=JobIdOut)
+def fix_project_tags(token=Depends(validate_token)):
+    """
+    Starts a job that creates the missing projects and recomputes the project tags
+    of all issues.
+    """
+    return JobIdOut(job_id=submit_job("fix-tags", fix_tags))
 
 
 @router.get("", response_model=list[Project])
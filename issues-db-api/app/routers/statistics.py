@@ -1,16 +1,46 @@
-import json
+import collections
+import math
+import multiprocessing
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from app.dependencies import jira_repos_db, statistics_collection
+from app.cache import (
+    invalidate_statistics_aggregates,
+    statistics_aggregates,
+    tagged_statistics_aggregates,
+)
+from app.dependencies import (
+    issue_labels_collection,
+    jira_repos_db,
+    statistics_collection,
+    statistics_watermarks_collection,
+)
+from app.encoding import JSON, media_types, negotiate_format, stream_records
+from app.exceptions import unknown_statistics_fields_exception
+from app.jobs import submit_job
 from app.routers.authentication import validate_token
-from fastapi import APIRouter, Depends
+from app.routers.jobs import JobIdOut
+from app.util import bulk_write_in_batches, split_in_chunks
+from fastapi import APIRouter, Depends, Header
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from pymongo import UpdateOne
 
 router = APIRouter(prefix="/statistics", tags=["statistics"])
 
+# Worker processes of the "processes" statistics builder
+STATISTICS_WORKERS = int(os.environ.get("STATISTICS_WORKERS", os.cpu_count() or 1))
+# Number of issues per _id range that is handed to a worker process
+STATISTICS_RANGE_SIZE = 10000
+# Number of issue ids per $match of /statistics/aggregate, which keeps every
+# aggregate command far below the 16MB BSON limit
+AGGREGATE_CHUNK_SIZE = 100000
+
 
 class Filter(BaseModel):
     issue_ids: list
+    fields: list[str] | None = None
 
 
 class Statistic(BaseModel):
@@ -34,6 +64,25 @@ class Statistics(BaseModel):
     data = dict[str, Statistic]
 
 
+class AggregateFilter(BaseModel):
+    issue_ids: list[str] | None = None
+    tags: list[str] | None = None
+
+
+class Count(BaseModel):
+    value: str | None
+    count: int
+
+
+class AggregateStatistics(BaseModel):
+    total: int
+    issue_type: list[Count]
+    status: list[Count]
+    resolution: list[Count]
+    repo: list[Count]
+    month_created: list[Count]
+
+
 def get_value(fields, path):
     current_item = fields
     keys = path.split("/")
@@ -44,81 +93,428 @@ def get_value(fields, path):
     return current_item
 
 
-def stream_statistics(issues):
-    yield '{"data": {'
+def stream_statistics(issues, stream_format: str = JSON):
+    return stream_records(
+        ((issue.pop("_id"), issue) for issue in issues), stream_format
+    )
 
-    first_item = True
-    for issue in issues:
-        issue_id = issue["_id"]
-        del issue["_id"]
-        if first_item:
-            yield f'"{issue_id}": {json.dumps(issue)}'
-            first_item = False
-        else:
-            yield f',"{issue_id}": {json.dumps(issue)}'
 
-    yield "}}"
+@router.get("", response_model=Statistics)
+def get_statistics(
+    request: Filter, accept: typing.Annotated[str | None, Header()] = None
+):
+    """
+    Returns the statistics of the given issues. Send "Accept: application/x-ndjson"
+    or "Accept: application/msgpack" to stream one issue at a time. When fields is
+    given, only those statistics are returned, and an empty list returns the ids
+    only.
+    """
+    stream_format = negotiate_format(accept)
+    projection = None
+    if request.fields is not None:
+        unknown_fields = [
+            field for field in request.fields if field not in Statistic.__fields__
+        ]
+        if unknown_fields:
+            raise unknown_statistics_fields_exception(unknown_fields)
+        # PyMongo turns an empty projection into {}, which returns all fields
+        projection = request.fields or {"_id": 1}
+    issues = statistics_collection.find({"_id": {"$in": request.issue_ids}}, projection)
+    return StreamingResponse(
+        stream_statistics(issues, stream_format), media_type=media_types[stream_format]
+    )
 
 
-@router.get("", response_model=Statistics)
-def get_statistics(request: Filter):
-    issues = statistics_collection.find({"_id": {"$in": request.issue_ids}})
-    return StreamingResponse(stream_statistics(issues), media_type="text/event-stream")
-
-
-@router.post("/calculate")
-def calculate_statistics(token=Depends(validate_token)):
-    for repo in jira_repos_db.list_collection_names():
-        for issue in jira_repos_db[repo].find({}):
-            issue_type = get_value(issue["fields"], "issuetype/name")
-            resolution = get_value(issue["fields"], "resolution/name")
-            created = get_value(issue["fields"], "created")
-            resolutiondate = get_value(issue["fields"], "resolutiondate")
-            subtasks = get_value(issue["fields"], "subtasks")
-            if subtasks is not None:
-                hierarchy = [f"{repo}-{subtask['id']}" for subtask in subtasks]
-            else:
-                hierarchy = []
-            status = get_value(issue["fields"], "status/name")
-            labels = get_value(issue["fields"], "labels")
-            attachments = get_value(issue["fields"], "attachment")
-            if attachments is None:
-                attachments = []
-            num_pdf_attachments = len(
-                [
-                    attachment
-                    for attachment in attachments
-                    if ".pdf" in attachment["filename"]
-                ]
+# The values by which /statistics/aggregate counts the issues
+aggregate_groups = {
+    "issue_type": "$issue_type",
+    "status": "$status",
+    "resolution": "$resolution",
+    # The _id is <repo>-<issue id>, and repo names may contain dashes
+    "repo": {
+        "$let": {
+            "vars": {"match": {"$regexFind": {"input": "$_id", "regex": "^(.*)-"}}},
+            "in": {"$arrayElemAt": ["$$match.captures", 0]},
+        }
+    },
+    # YYYY-MM of the creation date
+    "month_created": {
+        "$cond": [
+            {"$eq": [{"$type": "$created"}, "string"]},
+            {"$substrCP": ["$created", 0, 7]},
+            None,
+        ]
+    },
+}
+
+
+def _resolve_issue_ids(request: AggregateFilter):
+    """
+    Returns the ids of the issues that match the filter, or None for all issues.
+    Issues must have all given tags.
+    """
+    issue_ids = request.issue_ids
+    if request.tags is not None:
+        tagged_ids = [
+            issue["_id"]
+            for issue in issue_labels_collection.find(
+                {"tags": {"$all": request.tags}}, ["_id"]
+            )
+        ]
+        if issue_ids is None:
+            issue_ids = tagged_ids
+        else:
+            issue_ids = list(set(issue_ids).intersection(tagged_ids))
+    return issue_ids
+
+
+def _aggregate(issue_ids: list[str] | None) -> AggregateStatistics:
+    if issue_ids is None:
+        matches = [{}]
+    else:
+        matches = [
+            {"_id": {"$in": chunk}}
+            for chunk in split_in_chunks(issue_ids, AGGREGATE_CHUNK_SIZE)
+        ]
+    counts = {name: collections.Counter() for name in aggregate_groups}
+    for match in matches:
+        pipeline = [
+            {"$match": match},
+            {
+                "$facet": {
+                    name: [{"$group": {"_id": value, "count": {"$sum": 1}}}]
+                    for name, value in aggregate_groups.items()
+                }
+            },
+        ]
+        result = next(statistics_collection.aggregate(pipeline))
+        for name in aggregate_groups:
+            for group in result[name]:
+                counts[name][group["_id"]] += group["count"]
+    tables = {
+        name: [
+            Count(value=value, count=count)
+            # Missing values last
+            for value, count in sorted(
+                counter.items(), key=lambda item: (item[0] is None, item[0] or "")
             )
-            num_attachments = len(attachments)
-            watches = get_value(issue["fields"], "watches/watchCount")
-            votes = get_value(issue["fields"], "votes/votes")
-            summary = get_value(issue["fields"], "summary")
-            description = get_value(issue["fields"], "description")
-            comments = get_value(issue["fields"], "comment/comments")
-            if comments is None:
-                comments = []
-            comments = [comment["body"] for comment in comments]
-            statistics_collection.update_one(
+        ]
+        for name, counter in counts.items()
+    }
+    return AggregateStatistics(total=sum(counts["issue_type"].values()), **tables)
+
+
+@router.get("/aggregate", response_model=AggregateStatistics)
+def aggregate_statistics(request: AggregateFilter):
+    """
+    Returns the number of issues per issue type, status, resolution, repo and
+    month of creation, counted inside MongoDB. Without issue_ids and tags, all
+    issues are counted. Results of requests without issue_ids are cached for
+    STATISTICS_AGGREGATES_TTL seconds, until the statistics are calculated again
+    or, when filtered by tags, until the tags of issues change.
+    """
+    if request.issue_ids is not None:
+        return _aggregate(_resolve_issue_ids(request))
+    if request.tags is None:
+        return statistics_aggregates.get_or_compute(
+            None, lambda: _aggregate(_resolve_issue_ids(request))
+        )
+    return tagged_statistics_aggregates.get_or_compute(
+        tuple(sorted(set(request.tags))),
+        lambda: _aggregate(_resolve_issue_ids(request)),
+    )
+
+
+def compute_statistics(repo: str, fields: dict):
+    """
+    Returns the statistics of one issue, given the Jira fields of the issue.
+    """
+    subtasks = get_value(fields, "subtasks")
+    if subtasks is not None:
+        hierarchy = [f"{repo}-{subtask['id']}" for subtask in subtasks]
+    else:
+        hierarchy = []
+    attachments = get_value(fields, "attachment")
+    if attachments is None:
+        attachments = []
+    num_pdf_attachments = len(
+        [attachment for attachment in attachments if ".pdf" in attachment["filename"]]
+    )
+    comments = get_value(fields, "comment/comments")
+    if comments is None:
+        comments = []
+    return {
+        "issue_type": get_value(fields, "issuetype/name"),
+        "resolution": get_value(fields, "resolution/name"),
+        "created": get_value(fields, "created"),
+        "resolutiondate": get_value(fields, "resolutiondate"),
+        "hierarchy": hierarchy,
+        "status": get_value(fields, "status/name"),
+        "labels": get_value(fields, "labels"),
+        "num_pdf_attachments": num_pdf_attachments,
+        "num_attachments": len(attachments),
+        "watches": get_value(fields, "watches/watchCount"),
+        "votes": get_value(fields, "votes/votes"),
+        "summary": get_value(fields, "summary"),
+        "description": get_value(fields, "description"),
+        "comments": [comment["body"] for comment in comments],
+    }
+
+
+def statistics_pipeline(repo: str, filter_: dict):
+    """
+    Aggregation pipeline that computes the same documents as compute_statistics
+    inside MongoDB and merges them into the Statistics collection, so the raw
+    issues never leave the database.
+    """
+    return [
+        {"$match": filter_},
+        {
+            "$project": {
+                "_id": {"$concat": [f"{repo}-", "$id"]},
+                "issue_type": {"$ifNull": ["$fields.issuetype.name", None]},
+                "resolution": {"$ifNull": ["$fields.resolution.name", None]},
+                "created": {"$ifNull": ["$fields.created", None]},
+                "resolutiondate": {"$ifNull": ["$fields.resolutiondate", None]},
+                "hierarchy": {
+                    "$map": {
+                        "input": {"$ifNull": ["$fields.subtasks", []]},
+                        "as": "subtask",
+                        "in": {"$concat": [f"{repo}-", "$$subtask.id"]},
+                    }
+                },
+                "status": {"$ifNull": ["$fields.status.name", None]},
+                "labels": {"$ifNull": ["$fields.labels", None]},
+                "num_pdf_attachments": {
+                    "$size": {
+                        "$filter": {
+                            "input": {"$ifNull": ["$fields.attachment", []]},
+                            "as": "attachment",
+                            "cond": {
+                                "$gte": [
+                                    {"$indexOfCP": ["$$attachment.filename", ".pdf"]},
+                                    0,
+                                ]
+                            },
+                        }
+                    }
+                },
+                "num_attachments": {"$size": {"$ifNull": ["$fields.attachment", []]}},
+                "watches": {"$ifNull": ["$fields.watches.watchCount", None]},
+                "votes": {"$ifNull": ["$fields.votes.votes", None]},
+                "summary": {"$ifNull": ["$fields.summary", None]},
+                "description": {"$ifNull": ["$fields.description", None]},
+                "comments": {
+                    "$map": {
+                        "input": {"$ifNull": ["$fields.comment.comments", []]},
+                        "as": "comment",
+                        "in": "$$comment.body",
+                    }
+                },
+            }
+        },
+        {
+            "$merge": {
+                "into": {
+                    "db": statistics_collection.database.name,
+                    "coll": statistics_collection.name,
+                },
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+def build_with_python(job, repo: str, filter_: dict, count: int):
+    def operations():
+        for issue in jira_repos_db[repo].find(filter_):
+            yield UpdateOne(
                 {"_id": f"{repo}-{issue['id']}"},
+                {"$set": compute_statistics(repo, issue["fields"])},
+                upsert=True,
+            )
+            job.advance()
+
+    bulk_write_in_batches(statistics_collection, operations())
+
+
+def build_with_aggregation(job, repo: str, filter_: dict, count: int):
+    job.check_cancelled()
+    jira_repos_db[repo].aggregate(statistics_pipeline(repo, filter_))
+    job.advance(count)
+
+
+statistics_builders = {
+    "python": build_with_python,
+    "aggregation": build_with_aggregation,
+}
+
+
+def _id_ranges(repo: str, filter_: dict, count: int):
+    """
+    Splits the issues of the repo that match filter_ into _id ranges of about
+    STATISTICS_RANGE_SIZE issues. Returns a filter per range.
+    """
+    bounds = list(
+        jira_repos_db[repo].aggregate(
+            [
+                {"$match": filter_},
                 {
-                    "$set": {
-                        "issue_type": issue_type,
-                        "resolution": resolution,
-                        "created": created,
-                        "resolutiondate": resolutiondate,
-                        "hierarchy": hierarchy,
-                        "status": status,
-                        "labels": labels,
-                        "num_pdf_attachments": num_pdf_attachments,
-                        "num_attachments": num_attachments,
-                        "watches": watches,
-                        "votes": votes,
-                        "summary": summary,
-                        "description": description,
-                        "comments": comments,
+                    "$bucketAuto": {
+                        "groupBy": "$_id",
+                        "buckets": max(math.ceil(count / STATISTICS_RANGE_SIZE), 1),
                     }
                 },
+            ]
+        )
+    )
+    ranges = []
+    for idx, bound in enumerate(bounds):
+        # The max of a bucket is exclusive, except for the last bucket
+        if idx == len(bounds) - 1:
+            id_range = {"$gte": bound["_id"]["min"], "$lte": bound["_id"]["max"]}
+        else:
+            id_range = {"$gte": bound["_id"]["min"], "$lt": bound["_id"]["max"]}
+        ranges.append({"$and": [filter_, {"_id": id_range}]})
+    return ranges
+
+
+def _build_range(repo: str, filter_: dict) -> int:
+    """
+    Calculates the statistics of one _id range in a worker process and returns
+    the number of written issues.
+    """
+    result = bulk_write_in_batches(
+        statistics_collection,
+        (
+            UpdateOne(
+                {"_id": f"{repo}-{issue['id']}"},
+                {"$set": compute_statistics(repo, issue["fields"])},
+                upsert=True,
+            )
+            for issue in jira_repos_db[repo].find(filter_)
+        ),
+    )
+    return result["matched_count"] + result["upserted_count"]
+
+
+def build_with_processes(job, filters: dict, counts: dict, repo_done):
+    """
+    Calculates the statistics of all repos on STATISTICS_WORKERS processes, split
+    by repo and _id range. repo_done(repo) is called once all ranges of a repo
+    are written.
+    """
+    ranges = {repo: _id_ranges(repo, filters[repo], counts[repo]) for repo in filters}
+    remaining = {repo: len(repo_ranges) for repo, repo_ranges in ranges.items()}
+    for repo, num_ranges in remaining.items():
+        if num_ranges == 0:
+            repo_done(repo)
+    # Forking a process with open MongoClient connections is not safe
+    with ProcessPoolExecutor(
+        max_workers=STATISTICS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            executor.submit(_build_range, repo, range_filter): repo
+            for repo, repo_ranges in ranges.items()
+            for range_filter in repo_ranges
+        }
+        try:
+            for future in as_completed(futures):
+                repo = futures[future]
+                job.advance(future.result())
+                remaining[repo] -= 1
+                if remaining[repo] == 0:
+                    repo_done(repo)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def _changed_issues_filter(repo: str, incremental: bool):
+    if not incremental:
+        return {}
+    watermark = statistics_watermarks_collection.find_one({"_id": repo})
+    # Watermarks of calculations that used fields.updated are not comparable
+    if watermark is None or "downloaded_at" not in watermark:
+        return {}
+    return {
+        "$or": [
+            # Issues written at the watermark itself are recomputed, in case more
+            # issues were written in the same millisecond after the last run
+            {"downloaded_at": {"$gte": watermark["downloaded_at"]}},
+            # Issues that were not written by the downloader of the API
+            {"downloaded_at": None},
+        ]
+    }
+
+
+def _max_downloaded_at(repo: str, filter_: dict):
+    issue = jira_repos_db[repo].find_one(
+        filter_, ["downloaded_at"], sort=[("downloaded_at", -1)]
+    )
+    if issue is None:
+        return None
+    return issue.get("downloaded_at")
+
+
+def calculate_statistics_job(job, incremental: bool = False, builder: str = "python"):
+    try:
+        _calculate_statistics(job, incremental, builder)
+    finally:
+        # Also after a failure, since part of the statistics may be written
+        invalidate_statistics_aggregates()
+
+
+def _calculate_statistics(job, incremental: bool, builder: str):
+    repos = jira_repos_db.list_collection_names()
+    filters = {repo: _changed_issues_filter(repo, incremental) for repo in repos}
+    counts = {}
+    for repo in repos:
+        if filters[repo]:
+            counts[repo] = jira_repos_db[repo].count_documents(filters[repo])
+        else:
+            counts[repo] = jira_repos_db[repo].estimated_document_count()
+        job.add_total(counts[repo])
+    # Taken before the calculation, so issues that are downloaded meanwhile are
+    # calculated again by the next run
+    watermarks = {repo: _max_downloaded_at(repo, filters[repo]) for repo in repos}
+
+    def repo_done(repo):
+        # Only move the watermark once all issues of the repo are written
+        if watermarks[repo] is not None:
+            statistics_watermarks_collection.update_one(
+                {"_id": repo},
+                {"$max": {"downloaded_at": watermarks[repo]}},
                 upsert=True,
             )
+
+    if builder == "processes":
+        build_with_processes(job, filters, counts, repo_done)
+        return
+    build = statistics_builders[builder]
+    for repo in repos:
+        build(job, repo, filters[repo], counts[repo])
+        repo_done(repo)
+
+
+@router.post("/calculate", response_model=JobIdOut)
+def calculate_statistics(
+    incremental: bool = False,
+    builder: typing.Literal["python", "aggregation", "processes"] = "python",
+    token=Depends(validate_token),
+):
+    """
+    Starts a job that calculates the statistics of all issues in JiraRepos. With
+    incremental=true, only the issues that were downloaded since the last
+    calculation of their repo, or of which the download time is unknown, are
+    recalculated. The default python builder fetches the issues and computes the
+    statistics in the API, the processes builder does the same on
+    STATISTICS_WORKERS processes, split by repo and _id range, and the aggregation
+    builder computes them inside MongoDB with a $merge pipeline.
+    """
+    job_id = submit_job(
+        "calculate-statistics", calculate_statistics_job, incremental, builder
+    )
+    return JobIdOut(job_id=job_id)
@@ -7,6 +7,7 @@ from app.dependencies import (
     users_collection,
 )
 from app.routers.authentication import validate_token
+from app.cache import invalidate_issue_labels_counts
 from pymongo.errors import DuplicateKeyError
 from app.exceptions import tag_exists_exception, tag_not_found_exception
 
@@ -116,3 +117,4 @@ def delete_tag(tag: str, token=Depends(validate_token)):
     if result.deleted_count != 1:
         raise tag_not_found_exception(tag)
     issue_labels_collection.update_many({"tags": tag}, {"$pull": {"tags": tag}})
+    invalidate_issue_labels_counts()
@@ -2,6 +2,7 @@ from .test_util import client
 from .test_util import setup_users_db, restore_dbs, get_auth_header, auth_test_post
 from .bulk import get_issue_ids_from_keys, IssueKeysIn
 from app.dependencies import issue_labels_collection, tags_collection, jira_repos_db
+import json
 import pytest
 from fastapi import HTTPException
 
@@ -36,11 +37,15 @@ def test_add_tags_in_bulk():
             'tags': ['tag']
         }]
     }
-    assert client.post('/bulk/add-tags', headers=headers, json=payload).status_code == 200
+    response = client.post('/bulk/add-tags', headers=headers, json=payload)
+    assert response.status_code == 200
+    assert response.json() == {'matched_count': 1, 'modified_count': 1}
     assert issue_labels_collection.find_one({'_id': 'Apache-01'}, ['tags'])['tags'] == ['tag']
 
     # Insert existing tag
-    assert client.post('/bulk/add-tags', headers=headers, json=payload).status_code == 200
+    response = client.post('/bulk/add-tags', headers=headers, json=payload)
+    assert response.status_code == 200
+    assert response.json() == {'matched_count': 1, 'modified_count': 0}
     assert issue_labels_collection.find_one({'_id': 'Apache-01'}, ['tags'])['tags'] == ['tag']
 
     # Insert illegal tag
@@ -91,3 +96,23 @@ def test_get_issue_ids_from_keys():
         get_issue_ids_from_keys(payload)
 
     restore_dbs()
+
+
+def test_get_tags():
+    restore_dbs()
+    setup_db()
+
+    payload = {'issue_ids': ['Apache-01', 'Apache-02']}
+    response = client.request('GET', '/bulk/tags', json=payload)
+    assert response.status_code == 200
+    assert response.json() == {'data': {'Apache-01': []}, 'not_found': ['Apache-02']}
+
+    response = client.request(
+        'GET', '/bulk/tags', json=payload, headers={'Accept': 'application/x-ndjson'}
+    )
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {'issue_id': 'Apache-01', 'data': []},
+        {'not_found': ['Apache-02']}
+    ]
+
+    restore_dbs()
@@ -0,0 +1,34 @@
+from app import cache
+from app.cache import TTLCache, normalize_filter
+from bson import ObjectId
+
+
+def test_ttl_cache_max_size():
+    cache = TTLCache(ttl=None, max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Setting a again makes b the entry that was set longest ago
+    cache.set("a", 3)
+    cache.set("c", 4)
+    assert cache.get("a") == 3
+    assert cache.get("b") is None
+    assert cache.get("c") == 4
+
+
+def test_ttl_cache_expiry(monkeypatch):
+    monkeypatch.setattr(cache, "monotonic", lambda: 100)
+    ttl_cache = TTLCache(ttl=10)
+    ttl_cache.set("a", 1)
+    monkeypatch.setattr(cache, "monotonic", lambda: 110)
+    assert ttl_cache.get("a") == 1
+    monkeypatch.setattr(cache, "monotonic", lambda: 111)
+    assert ttl_cache.get("a") is None
+    assert ttl_cache.get_or_compute("a", lambda: 2) == 2
+
+
+def test_normalize_filter():
+    object_id = ObjectId()
+    assert normalize_filter({"a": 1, "b": 2}) == normalize_filter({"b": 2, "a": 1})
+    assert normalize_filter({"_id": object_id}) != normalize_filter(
+        {"_id": str(object_id)}
+    )
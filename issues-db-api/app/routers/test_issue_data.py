@@ -1,8 +1,12 @@
+import json
+
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
 import pytest
 
 from app.dependencies import jira_repos_db, repo_info_collection
+from app.encoding import NDJSON
+from . import issue_data
 from .issue_data import get_issue_data, IssueDataIn
 from .test_util import restore_dbs
 
@@ -114,3 +118,54 @@ def test_issue_data_endpoint():
         )
 
     restore_dbs()
+
+
+def test_issue_data_chunks(monkeypatch):
+    restore_dbs()
+    setup_db()
+    jira_repos_db["Apache"].insert_one(
+        {
+            "id": "13211410",
+            "key": "YARN-9231",
+            "fields": {"summary": "Second issue"},
+        }
+    )
+    monkeypatch.setattr(issue_data, "MAX_IDS_PER_QUERY", 1)
+
+    request = IssueDataIn(
+        issue_ids=["Apache-13211409", "Apache-13211410"], attributes=["key"]
+    )
+    response = b"".join(
+        issue_data.streaming_issue_data(
+            request, issue_data._group_ids_by_repo(request.issue_ids)
+        )
+    )
+    assert json.loads(response) == {
+        "data": {
+            "Apache-13211409": {"key": "YARN-9230"},
+            "Apache-13211410": {"key": "YARN-9231"},
+        }
+    }
+
+    # Test unknown repo
+    with pytest.raises(HTTPException):
+        get_issue_data(IssueDataIn(issue_ids=["Unknown-1"], attributes=["key"]))
+
+    restore_dbs()
+
+
+def test_issue_data_ndjson():
+    restore_dbs()
+    setup_db()
+
+    request = IssueDataIn(issue_ids=["Apache-13211409"], attributes=["key"])
+    response = b"".join(
+        issue_data.streaming_issue_data(
+            request, issue_data._group_ids_by_repo(request.issue_ids), NDJSON
+        )
+    )
+    assert [json.loads(line) for line in response.splitlines()] == [
+        {"issue_id": "Apache-13211409", "data": {"key": "YARN-9230"}}
+    ]
+
+    restore_dbs()
@@ -1,7 +1,26 @@
+from datetime import datetime
+from threading import Barrier, Event, Lock
+
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
 from app import app
-from app.dependencies import repo_info_collection
+from app import jirarepos_download as jira_download
+from app.dependencies import (
+    repo_info_collection,
+    issue_labels_collection,
+    jira_repos_db,
+)
+from app.jirarepos_download import (
+    download_concurrently,
+    write_issues,
+    get_query,
+    get_search_options,
+    REQUIRED_FIELDS,
+)
+from app.routers import jirarepos_download
+from app.routers.jirarepos_download import download_repo, RequestIn
 from .test_util import (
     setup_users_db,
     restore_dbs,
@@ -38,6 +57,8 @@ def test_get_repo_info():
             "download_date": None,
             "batch_size": 1000,
             "query_wait_time_minutes": 0.0,
+            "fields": None,
+            "changelog": True,
         }
     ]
 
@@ -66,6 +87,8 @@ def test_add_repo():
         "download_date": None,
         "batch_size": 1000,
         "query_wait_time_minutes": 0.0,
+        "fields": None,
+        "changelog": True,
     }
 
     restore_dbs()
@@ -85,6 +108,8 @@ def test_update_repo():
         "download_date": "2023-01-01",
         "batch_size": 42,
         "query_wait_time_minutes": 0.42,
+        "fields": ["summary", "customfield_12310220"],
+        "changelog": False,
     }
     assert (
         client.put(
@@ -98,6 +123,8 @@ def test_update_repo():
         "download_date": "2023-01-01",
         "batch_size": 42,
         "query_wait_time_minutes": 0.42,
+        "fields": ["summary", "customfield_12310220"],
+        "changelog": False,
     }
 
     # Invalid updates
@@ -157,3 +184,270 @@ def test_delete_repo():
     assert client.delete("/jira-repos/name_of_repo", headers=headers).status_code == 404
 
     restore_dbs()
+
+
+def test_download_concurrently():
+    repo_infos = [
+        {"_id": "repo1", "repo_url": "https://jira.one.org"},
+        {"_id": "repo2", "repo_url": "https://jira.two.org"},
+        {"_id": "repo3", "repo_url": "https://jira.two.org/jira"},
+    ]
+
+    # Different hosts run at the same time, the same host one repo at a time
+    barrier = Barrier(2, timeout=10)
+    lock = Lock()
+    running = {"https://jira.two.org": 0}
+    max_running = {"https://jira.two.org": 0}
+    rate_limiters = {}
+
+    def download_repo(repo_info, rate_limiter):
+        rate_limiters[repo_info["_id"]] = rate_limiter
+        if repo_info["_id"] == "repo1":
+            barrier.wait()
+            return
+        host = "https://jira.two.org"
+        with lock:
+            running[host] += 1
+            max_running[host] = max(max_running[host], running[host])
+        if repo_info["_id"] == "repo2":
+            barrier.wait()
+        with lock:
+            running[host] -= 1
+
+    download_concurrently(repo_infos, download_repo)
+    assert max_running["https://jira.two.org"] == 1
+    assert rate_limiters["repo2"] is rate_limiters["repo3"]
+    assert rate_limiters["repo1"] is not rate_limiters["repo2"]
+
+    # Failures are reported after all repos are downloaded
+    downloaded = []
+
+    def failing_download_repo(repo_info, rate_limiter):
+        if repo_info["_id"] == "repo1":
+            raise ValueError("connection refused")
+        downloaded.append(repo_info["_id"])
+
+    with pytest.raises(HTTPException) as e:
+        download_concurrently(repo_infos, failing_download_repo)
+    assert e.value.status_code == 502
+    assert "repo1" in e.value.detail
+    assert sorted(downloaded) == ["repo2", "repo3"]
+
+
+def test_write_issues():
+    restore_dbs()
+    jira_repos_db["Apache"].insert_one({"id": "1", "key": "OLD-1", "fields": {}})
+    issue_labels_collection.insert_one(
+        {
+            "_id": "Apache-1",
+            "existence": True,
+            "property": None,
+            "executive": None,
+            "tags": ["Apache-OLD", "has-label"],
+            "comments": {},
+            "predictions": {},
+        }
+    )
+
+    write_issues(
+        "Apache",
+        [
+            {"id": "1", "key": "NEW-1", "fields": {"summary": "moved"}},
+            {"id": "2", "key": "NEW-2", "fields": {}},
+        ],
+    )
+
+    # Issues are replaced or inserted, with the time of the write
+    assert jira_repos_db["Apache"].count_documents({}) == 2
+    issue = jira_repos_db["Apache"].find_one({"id": "1"}, {"_id": 0})
+    assert isinstance(issue.pop("downloaded_at"), datetime)
+    assert issue == {"id": "1", "key": "NEW-1", "fields": {"summary": "moved"}}
+
+    # Project tag is moved, existing labels are kept
+    assert issue_labels_collection.find_one({"_id": "Apache-1"}) == {
+        "_id": "Apache-1",
+        "existence": True,
+        "property": None,
+        "executive": None,
+        "tags": ["has-label", "Apache-NEW"],
+        "comments": {},
+        "predictions": {},
+    }
+    assert issue_labels_collection.find_one({"_id": "Apache-2"}) == {
+        "_id": "Apache-2",
+        "existence": None,
+        "property": None,
+        "executive": None,
+        "tags": ["Apache-NEW"],
+        "comments": {},
+        "predictions": {},
+    }
+
+    restore_dbs()
+
+
+def test_download_repo_checkpoint(monkeypatch):
+    restore_dbs()
+    setup_db()
+    request = RequestIn(repos=None, enable_auth=False, username=None, password=None)
+
+    # Fail after the first page was written
+    def failing_download(*args, start_index, save_checkpoint, **kwargs):
+        assert start_index == 0
+        save_checkpoint(250)
+        raise ConnectionError()
+
+    monkeypatch.setattr(jirarepos_download, "download_multiprocessed", failing_download)
+    with pytest.raises(ConnectionError):
+        download_repo(repo_info_collection.find_one({"_id": "name_of_repo"}), request)
+    repo_info = repo_info_collection.find_one({"_id": "name_of_repo"})
+    assert repo_info["download_date"] is None
+    checkpoint = repo_info["checkpoint"]
+    assert checkpoint["query"] == get_query(None)
+    assert checkpoint["start_at"] == 250
+
+    # Resume from the checkpoint and keep the date of the first attempt
+    def resumed_download(*args, start_index, save_checkpoint, **kwargs):
+        assert start_index == 250
+        save_checkpoint(500)
+
+    monkeypatch.setattr(jirarepos_download, "download_multiprocessed", resumed_download)
+    download_repo(repo_info, request)
+    repo_info = repo_info_collection.find_one({"_id": "name_of_repo"})
+    assert repo_info["download_date"] == checkpoint["download_date"]
+    assert "checkpoint" not in repo_info
+
+    restore_dbs()
+
+
+def test_download_repo_creates_indexes(monkeypatch):
+    restore_dbs()
+    setup_db()
+    request = RequestIn(repos=None, enable_auth=False, username=None, password=None)
+    assert "name_of_repo" not in jira_repos_db.list_collection_names()
+
+    def download(jira_name, *args, **kwargs):
+        # The new collection is indexed before the first upsert
+        assert "id_1" in jira_repos_db[jira_name].index_information()
+        write_issues(jira_name, [{"id": "1", "key": "KEY-1", "fields": {}}])
+
+    monkeypatch.setattr(jirarepos_download, "download_multiprocessed", download)
+    download_repo(repo_info_collection.find_one({"_id": "name_of_repo"}), request)
+    indexes = jira_repos_db["name_of_repo"].index_information()
+    assert indexes["id_1"]["key"] == [("id", 1)]
+    assert indexes["key_1"]["key"] == [("key", 1)]
+    assert jira_repos_db["name_of_repo"].count_documents({}) == 1
+
+    restore_dbs()
+
+
+def test_download_overlaps_fetch_and_write(monkeypatch):
+    page_size = 2
+    second_page_requested = Event()
+    written = []
+
+    def fake_get_response(
+        jira, download_date, start_index, iteration_max, *args, **kwargs
+    ):
+        if start_index >= page_size:
+            second_page_requested.set()
+        return {
+            "issues": [
+                {"id": str(idx), "key": f"KEY-{idx}"}
+                for idx in range(start_index, start_index + iteration_max)
+            ]
+        }
+
+    def fake_write_issues(jira_name, issues):
+        # The next page is fetched while this one is being written
+        if not written:
+            assert second_page_requested.wait(timeout=10)
+        written.append([issue["id"] for issue in issues])
+
+    monkeypatch.setattr(jira_download, "get_response", fake_get_response)
+    monkeypatch.setattr(jira_download, "write_issues", fake_write_issues)
+    checkpoints = []
+    jira_download.download_and_write_data_mongo(
+        "Repo",
+        None,
+        None,
+        None,
+        page_size,
+        0,
+        3 * page_size,
+        save_checkpoint=checkpoints.append,
+    )
+    assert written == [["0", "1"], ["2", "3"], ["4", "5"]]
+    assert checkpoints == [2, 4, 6]
+
+
+def test_get_search_options():
+    assert get_search_options() == {"fields": "*all", "expand": "changelog"}
+    options = get_search_options(["summary", "customfield_12310220"], False)
+    assert options["expand"] is None
+    assert options["fields"].split(",") == REQUIRED_FIELDS + ["customfield_12310220"]
+
+
+def test_issue_data_of_profile_download():
+    restore_dbs()
+    all_fields = {
+        "summary": "Summary",
+        "description": "Description",
+        "issuetype": {"name": "Sub-task"},
+        "status": {"name": "Open"},
+        "resolution": None,
+        "created": "2023-01-01T00:00:00.000+0000",
+        "updated": "2023-01-01T00:00:00.000+0000",
+        "resolutiondate": None,
+        "labels": [],
+        "components": [{"name": "core"}],
+        "assignee": None,
+        "subtasks": [],
+        "attachment": [],
+        "watches": {"watchCount": 1},
+        "votes": {"votes": 0},
+        "comment": {"comments": []},
+        "parent": {"id": "1"},
+        "issuelinks": [{"type": {"name": "Blocks"}, "outwardIssue": {"id": "3"}}],
+        "environment": "Linux",
+    }
+    # Jira only returns the fields of the download profile
+    profile = get_search_options(["customfield_12310220"], False)["fields"]
+    fields = {
+        name: value for name, value in all_fields.items() if name in profile.split(",")
+    }
+    write_issues("Apache", [{"id": "2", "key": "KEY-2", "fields": fields}])
+
+    attributes = [
+        "summary",
+        "description",
+        "labels",
+        "components",
+        "votes",
+        "watches",
+        "parent",
+        "issuelinks",
+        "resolution",
+        "assignee",
+        "resolutiondate",
+        "subtasks",
+    ]
+    response = client.request(
+        "GET",
+        "/issue-data",
+        json={"issue_ids": ["Apache-2"], "attributes": attributes},
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]["Apache-2"]
+    assert data["parent"] == "Apache-1"
+    assert data["issuelinks"][0]["outwardIssue"] == "Apache-3"
+    assert data["components"] == [{"name": "core"}]
+
+    # Fields outside the profile are not downloaded
+    with pytest.raises(HTTPException):
+        client.request(
+            "GET",
+            "/issue-data",
+            json={"issue_ids": ["Apache-2"], "attributes": ["environment"]},
+        )
+    restore_dbs()
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+from threading import Event
+from time import sleep
+
+from bson import ObjectId
+
+from app.dependencies import jobs_collection
+from app.jobs import HEARTBEAT_TIMEOUT, fail_interrupted_jobs, submit_job
+from .test_util import (
+    client,
+    restore_dbs,
+    setup_users_db,
+    get_auth_header,
+    auth_test_post,
+    wait_for_job,
+)
+
+
+def count_job(job, amount: int):
+    job.add_total(amount)
+    for _ in range(amount):
+        job.advance()
+
+
+def failing_job(job):
+    raise ValueError("something went wrong")
+
+
+def blocking_job(job, started: Event):
+    started.set()
+    while True:
+        job.check_cancelled()
+        sleep(0.1)
+
+
+def test_get_job():
+    restore_dbs()
+
+    job_id = submit_job("count", count_job, 10)
+    job = wait_for_job(job_id)
+    assert job["job_id"] == job_id
+    assert job["name"] == "count"
+    assert job["status"] == "completed"
+    assert job["total"] == 10
+    assert job["done"] == 10
+    assert job["progress"] == 1.0
+    assert job["eta_seconds"] is None
+    assert job["error"] is None
+    assert job["finished_at"] is not None
+
+    assert [job["job_id"] for job in client.get("/jobs").json()] == [job_id]
+
+    # Non-existing job
+    assert client.get(f"/jobs/{ObjectId()}").status_code == 404
+    assert client.get("/jobs/illegal-id").status_code == 404
+
+    restore_dbs()
+
+
+def test_failed_job():
+    restore_dbs()
+
+    job = wait_for_job(submit_job("fail", failing_job))
+    assert job["status"] == "failed"
+    assert job["error"] == "something went wrong"
+
+    restore_dbs()
+
+
+def test_cancel_job():
+    restore_dbs()
+    setup_users_db()
+
+    started = Event()
+    job_id = submit_job("block", blocking_job, started)
+    auth_test_post(f"/jobs/{job_id}/cancel")
+    headers = get_auth_header()
+    assert started.wait(timeout=10)
+
+    # Cancel running job
+    assert client.post(f"/jobs/{job_id}/cancel", headers=headers).status_code == 200
+    assert wait_for_job(job_id)["status"] == "cancelled"
+
+    # Already finished
+    assert client.post(f"/jobs/{job_id}/cancel", headers=headers).status_code == 409
+
+    # Non-existing job
+    assert client.post(f"/jobs/{ObjectId()}/cancel", headers=headers).status_code == 404
+
+    restore_dbs()
+
+
+def insert_running_job(heartbeat_age: float):
+    now = datetime.utcnow()
+    return jobs_collection.insert_one(
+        {
+            "name": "other-worker",
+            "status": "running",
+            "total": 0,
+            "done": 0,
+            "cancel_requested": False,
+            "error": None,
+            "created_at": now,
+            "started_at": now,
+            "finished_at": None,
+            "owner": {"host": "other-host", "pid": 1, "instance_id": "other"},
+            "heartbeat_at": now - timedelta(seconds=heartbeat_age),
+        }
+    ).inserted_id
+
+
+def test_fail_interrupted_jobs():
+    restore_dbs()
+
+    live_job_id = insert_running_job(0)
+    stale_job_id = insert_running_job(HEARTBEAT_TIMEOUT + 60)
+    fail_interrupted_jobs()
+    # Jobs of another running worker are left alone
+    assert jobs_collection.find_one({"_id": live_job_id})["status"] == "running"
+    assert jobs_collection.find_one({"_id": stale_job_id})["status"] == "failed"
+
+    restore_dbs()
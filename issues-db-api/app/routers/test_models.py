@@ -10,6 +10,7 @@ from .test_util import (
     setup_users_db,
     restore_dbs,
     get_auth_header,
+    wait_for_job,
     auth_test_post,
     auth_test_delete,
     auth_test_put,
@@ -149,7 +150,9 @@ def test_delete_model():
     headers = get_auth_header()
 
     # Delete model
-    assert client.delete(f"/models/{model_id}", headers=headers).status_code == 200
+    response = client.delete(f"/models/{model_id}", headers=headers)
+    assert response.status_code == 200
+    assert wait_for_job(response.json()["job_id"])["status"] == "completed"
     assert models_collection.find_one({"_id": model_id}) is None
     assert fs.exists(version_id) is False
 
@@ -226,12 +229,11 @@ def test_delete_model_version():
     headers = get_auth_header()
 
     # Delete version
-    assert (
-        client.delete(
-            f"/models/{model_id}/versions/{version_id}", headers=headers
-        ).status_code
-        == 200
+    response = client.delete(
+        f"/models/{model_id}/versions/{version_id}", headers=headers
     )
+    assert response.status_code == 200
+    assert wait_for_job(response.json()["job_id"])["status"] == "completed"
     assert models_collection.find_one({"_id": model_id})["versions"] == {}
     assert fs.exists(version_id) is False
 
@@ -283,6 +285,15 @@ def test_update_version_description():
     restore_dbs()
 
 
+def post_predictions_file(model_id, version_id, headers, filename, content: bytes):
+    files = {"file": (filename, io.BytesIO(content))}
+    return client.post(
+        f"/models/{model_id}/versions/{version_id}/predictions",
+        headers=headers,
+        files=files,
+    )
+
+
 def test_post_predictions():
     restore_dbs()
     setup_users_db()
@@ -297,13 +308,14 @@ def test_post_predictions():
             "Apache-01": {"property": {"confidence": 0.42, "prediction": False}}
         }
     }
-    files = {"file": ("filename", io.BytesIO(bytes(json.dumps(payload), "utf-8")))}
-    response = client.post(
-        f"/models/{model_id}/versions/{version_id}/predictions",
-        headers=headers,
-        files=files,
+    response = post_predictions_file(
+        model_id, version_id, headers, "filename", bytes(json.dumps(payload), "utf-8")
     )
     assert response.status_code == 200
+    job = wait_for_job(response.json()["job_id"])
+    assert job["status"] == "completed"
+    assert job["total"] == 1
+    assert job["done"] == 1
     assert issue_labels_collection.find_one({"_id": "Apache-01"})["predictions"] == {
         f"{model_id}-{version_id}": {
             "property": {"confidence": 0.42, "prediction": False}
@@ -311,11 +323,28 @@ def test_post_predictions():
     }
     assert len(issue_labels_collection.index_information()) == 3
 
+    # Post predictions as NDJSON
+    lines = [
+        {
+            "issue_id": "Apache-01",
+            "predictions": {"existence": {"confidence": 1, "prediction": True}},
+        }
+    ]
+    ndjson = b"".join(bytes(json.dumps(line) + "\n", "utf-8") for line in lines)
+    response = post_predictions_file(
+        model_id, version_id, headers, "filename.ndjson", ndjson
+    )
+    assert response.status_code == 200
+    assert wait_for_job(response.json()["job_id"])["status"] == "completed"
+    assert issue_labels_collection.find_one({"_id": "Apache-01"})["predictions"] == {
+        f"{model_id}-{version_id}": {
+            "existence": {"confidence": 1.0, "prediction": True}
+        }
+    }
+
     # Non-existing version
-    response = client.post(
-        f"/models/{model_id}/versions/{ObjectId()}/predictions",
-        headers=headers,
-        files=files,
+    response = post_predictions_file(
+        model_id, ObjectId(), headers, "filename.ndjson", ndjson
     )
     assert response.status_code == 404
 
@@ -325,13 +354,13 @@ def test_post_predictions():
             "Non-existing-id": {"property": {"confidence": 0.42, "prediction": False}}
         }
     }
-    files = {"file": ("filename", io.BytesIO(bytes(json.dumps(payload), "utf-8")))}
-    response = client.post(
-        f"/models/{model_id}/versions/{version_id}/predictions",
-        headers=headers,
-        files=files,
+    response = post_predictions_file(
+        model_id, version_id, headers, "filename", bytes(json.dumps(payload), "utf-8")
     )
-    assert response.status_code == 404
+    assert response.status_code == 200
+    job = wait_for_job(response.json()["job_id"])
+    assert job["status"] == "failed"
+    assert "Non-existing-id" in job["error"]
 
     restore_dbs()
 
@@ -366,6 +395,38 @@ def test_get_predictions():
     restore_dbs()
 
 
+def test_get_predictions_streamed():
+    restore_dbs()
+    model_id, version_id, _ = setup_db()
+
+    url = f"/models/{model_id}/versions/{version_id}/predictions"
+    payload = {"issue_ids": ["Apache-01", "Apache-02"], "batch_size": 1}
+    response = client.request("GET", url, json=payload)
+    assert response.json() == {
+        "predictions": {
+            "Apache-01": {"existence": {"confidence": 0.42, "prediction": False}},
+            "Apache-02": None,
+        }
+    }
+
+    response = client.request(
+        "GET", url, json=payload, headers={"Accept": "application/x-ndjson"}
+    )
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {
+            "issue_id": "Apache-01",
+            "predictions": {"existence": {"confidence": 0.42, "prediction": False}},
+        },
+        {"issue_id": "Apache-02", "predictions": None},
+    ]
+
+    # Invalid batch size
+    payload = {"issue_ids": None, "batch_size": 0}
+    assert client.request("GET", url, json=payload).status_code == 422
+
+    restore_dbs()
+
+
 def test_delete_predictions():
     restore_dbs()
     setup_users_db()
@@ -375,12 +436,11 @@ def test_delete_predictions():
     headers = get_auth_header()
 
     # Delete version
-    assert (
-        client.delete(
-            f"/models/{model_id}/versions/{version_id}/predictions", headers=headers
-        ).status_code
-        == 200
+    response = client.delete(
+        f"/models/{model_id}/versions/{version_id}/predictions", headers=headers
     )
+    assert response.status_code == 200
+    assert wait_for_job(response.json()["job_id"])["status"] == "completed"
     assert issue_labels_collection.find_one({"_id": "Apache-01"})["predictions"] == {}
 
     # Non-existing version
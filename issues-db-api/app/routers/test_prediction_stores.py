@@ -0,0 +1,137 @@
+import pytest
+from app.dependencies import (
+    create_predictions_collection,
+    issue_labels_collection,
+    predictions_collection,
+)
+from app.predictions import CollectionPredictionStore, EmbeddedPredictionStore
+from app.util import find_missing_ids
+from bson import ObjectId
+
+from .test_util import restore_dbs
+
+MODEL_ID = str(ObjectId())
+VERSION_ID = str(ObjectId())
+MODEL = f"{MODEL_ID}-{VERSION_ID}"
+CONFIDENCE = f"predictions.{MODEL}.existence.confidence"
+
+
+def prediction(confidence: float):
+    return {"existence": {"prediction": confidence > 0.5, "confidence": confidence}}
+
+
+@pytest.fixture(params=["embedded", "collection"])
+def store(request):
+    restore_dbs()
+    for issue_id, tags in [
+        ("Apache-1", ["a"]),
+        ("Apache-2", ["b"]),
+        ("Apache-3", ["a"]),
+    ]:
+        issue_labels_collection.insert_one(
+            {
+                "_id": issue_id,
+                "existence": None,
+                "property": None,
+                "executive": None,
+                "tags": tags,
+                "comments": {},
+                "predictions": {},
+            }
+        )
+    if request.param == "collection":
+        create_predictions_collection()
+        store = CollectionPredictionStore()
+    else:
+        store = EmbeddedPredictionStore()
+    # Apache-3 has no predictions
+    missing_ids = store.write(
+        MODEL_ID,
+        VERSION_ID,
+        [
+            ("Apache-1", prediction(0.2)),
+            ("Apache-2", prediction(0.8)),
+            ("Apache-9", prediction(0.5)),
+        ],
+    )
+    assert find_missing_ids(issue_labels_collection, missing_ids) == ["Apache-9"]
+    store.create_indexes(MODEL_ID, VERSION_ID, {"existence"})
+    yield store
+    restore_dbs()
+
+
+def test_find(store):
+    assert sorted(store.find(MODEL_ID, VERSION_ID, None, 1)) == [
+        ("Apache-1", prediction(0.2)),
+        ("Apache-2", prediction(0.8)),
+    ]
+    assert list(store.find(MODEL_ID, VERSION_ID, ["Apache-2", "Apache-3"], 1)) == [
+        ("Apache-2", prediction(0.8))
+    ]
+
+
+def test_get_for_issues(store):
+    issues = store.find_issues({}, [("_id", 1)], 10)
+    assert store.get_for_issues(issues, [MODEL]) == {
+        "Apache-1": {MODEL: prediction(0.2)},
+        "Apache-2": {MODEL: prediction(0.8)},
+        "Apache-3": {},
+    }
+    assert store.get_for_issues(issues, []) == {
+        "Apache-1": {},
+        "Apache-2": {},
+        "Apache-3": {},
+    }
+
+
+def test_find_issues(store):
+    def ids(issues):
+        return [issue["_id"] for issue in issues]
+
+    sort = [(CONFIDENCE, -1), ("_id", -1)]
+    assert ids(store.find_issues({}, sort, 2)) == ["Apache-2", "Apache-1"]
+    assert ids(store.find_issues({}, sort, 1, skip=1)) == ["Apache-1"]
+    assert ids(store.find_issues({"tags": "a"}, sort, 1)) == ["Apache-1"]
+    # Seek past Apache-2, as the continuation tokens of the UI do
+    seek_filter = {
+        "$or": [
+            {CONFIDENCE: {"$lt": 0.8}},
+            {CONFIDENCE: 0.8, "_id": {"$lt": "Apache-2"}},
+        ]
+    }
+    assert ids(store.find_issues({}, sort, 1, seek_filter=seek_filter)) == ["Apache-1"]
+    issue = store.find_issues({}, sort, 1)[0]
+    assert issue["predictions"][MODEL] == prediction(0.8)
+
+    # Without sorting on predictions, all issues are returned
+    assert ids(store.find_issues({}, [("_id", 1)], 10)) == [
+        "Apache-1",
+        "Apache-2",
+        "Apache-3",
+    ]
+
+
+def test_delete(store):
+    store.delete(MODEL_ID, VERSION_ID)
+    assert list(store.find(MODEL_ID, VERSION_ID, None, 10)) == []
+    issues = store.find_issues({}, [("_id", 1)], 10)
+    assert store.get_for_issues(issues, [MODEL]) == {
+        "Apache-1": {},
+        "Apache-2": {},
+        "Apache-3": {},
+    }
+
+
+def test_collection_store_indexes(store):
+    if not isinstance(store, CollectionPredictionStore):
+        pytest.skip("Only the collection store indexes the Predictions collection")
+    keys = [
+        [key for key, _ in index["key"]]
+        for index in predictions_collection.index_information().values()
+    ]
+    assert [
+        "model_id",
+        "version_id",
+        "predictions.existence.confidence",
+        "issue_id",
+    ] in keys
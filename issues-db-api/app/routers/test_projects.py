@@ -5,8 +5,13 @@ from .test_util import (
     auth_test_post,
     auth_test_put,
     auth_test_delete,
+    wait_for_job,
+)
+from app.dependencies import (
+    projects_collection,
+    issue_labels_collection,
+    jira_repos_db,
 )
-from app.dependencies import projects_collection, issue_labels_collection
 
 
 def test_get_projects():
@@ -107,3 +112,25 @@ def test_delete_project():
 
     assert client.delete(url, headers=headers).status_code == 200
     assert projects_collection.find_one({"_id": "Apache-CASSANDRA"}) is None
+
+
+def test_fix_tags():
+    setup_dbs()
+    jira_repos_db["Apache"].update_one({"_id": 0}, {"$set": {"id": "0"}})
+    url = "/projects/fix-tags"
+    auth_test_post(url)
+    headers = get_auth_header()
+
+    response = client.post(url, headers=headers)
+    assert response.status_code == 200
+    job = wait_for_job(response.json()["job_id"])
+    assert job["status"] == "completed"
+    assert job["done"] == job["total"] == 2
+    assert issue_labels_collection.find_one({"_id": "Apache-0"})["tags"] == [
+        "Apache-CASSANDRA",
+        "project-ecosystem=Apache",
+        "project-key=CASSANDRA",
+        "project-property1=value",
+        "project-property2=value1",
+        "project-property2=value2",
+    ]
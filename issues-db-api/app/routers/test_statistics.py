@@ -0,0 +1,328 @@
+from datetime import datetime
+
+from app.cache import invalidate_issue_labels_counts
+from app.jirarepos_download import write_issues
+from app.dependencies import (
+    issue_labels_collection,
+    jira_repos_db,
+    statistics_collection,
+    statistics_watermarks_collection,
+)
+from .test_util import (
+    client,
+    restore_dbs,
+    setup_users_db,
+    get_auth_header,
+    auth_test_post,
+    wait_for_job,
+)
+
+
+def make_issue(issue_id: str, summary: str, updated: str, downloaded_at: datetime):
+    return {
+        "id": issue_id,
+        "downloaded_at": downloaded_at,
+        "key": f"CASSANDRA-{issue_id}",
+        "fields": {
+            "issuetype": {"name": "Bug"},
+            "resolution": None,
+            "created": "2023-01-01T00:00:00.000+0000",
+            "updated": updated,
+            "resolutiondate": None,
+            "subtasks": [{"id": "3"}],
+            "status": {"name": "Open"},
+            "labels": ["label"],
+            "attachment": [{"filename": "file.pdf"}, {"filename": "file.txt"}],
+            "watches": {"watchCount": 2},
+            "votes": {"votes": 1},
+            "summary": summary,
+            "description": "description",
+            "comment": {"comments": [{"body": "comment"}]},
+        },
+    }
+
+
+def setup_db():
+    jira_repos_db["Apache"].insert_many(
+        [
+            make_issue(
+                "1", "summary", "2023-01-01T00:00:00.000+0000", datetime(2023, 1, 1)
+            ),
+            make_issue(
+                "2", "summary", "2023-02-01T00:00:00.000+0000", datetime(2023, 2, 1)
+            ),
+        ]
+    )
+
+
+def calculate(headers, incremental=False, builder="python"):
+    response = client.post(
+        f"/statistics/calculate?incremental={str(incremental).lower()}"
+        f"&builder={builder}",
+        headers=headers,
+    )
+    assert response.status_code == 200
+    return wait_for_job(response.json()["job_id"])
+
+
+def test_calculate_statistics():
+    restore_dbs()
+    setup_users_db()
+    setup_db()
+
+    auth_test_post("/statistics/calculate")
+    headers = get_auth_header()
+
+    job = calculate(headers)
+    assert job["status"] == "completed"
+    assert job["done"] == 2
+    assert statistics_collection.find_one({"_id": "Apache-1"}) == {
+        "_id": "Apache-1",
+        "issue_type": "Bug",
+        "resolution": None,
+        "created": "2023-01-01T00:00:00.000+0000",
+        "resolutiondate": None,
+        "hierarchy": ["Apache-3"],
+        "status": "Open",
+        "labels": ["label"],
+        "num_pdf_attachments": 1,
+        "num_attachments": 2,
+        "watches": 2,
+        "votes": 1,
+        "summary": "summary",
+        "description": "description",
+        "comments": ["comment"],
+    }
+    assert statistics_watermarks_collection.find_one({"_id": "Apache"}) == {
+        "_id": "Apache",
+        "downloaded_at": datetime(2023, 2, 1),
+    }
+
+    # Only issues downloaded since the last calculation are recalculated
+    jira_repos_db["Apache"].replace_one(
+        {"id": "1"},
+        make_issue(
+            "1", "new summary", "2023-03-01T00:00:00.000+0000", datetime(2023, 3, 1)
+        ),
+    )
+    job = calculate(headers, incremental=True)
+    assert job["status"] == "completed"
+    assert job["done"] == 2
+    assert statistics_collection.find_one({"_id": "Apache-1"})["summary"] == (
+        "new summary"
+    )
+    assert statistics_watermarks_collection.find_one({"_id": "Apache"}) == {
+        "_id": "Apache",
+        "downloaded_at": datetime(2023, 3, 1),
+    }
+    job = calculate(headers, incremental=True)
+    assert job["done"] == 1
+
+    # Issues that are downloaded after a calculation are recalculated, even when
+    # Jira updated them before it
+    jira_repos_db["Apache"].replace_one(
+        {"id": "2"},
+        make_issue(
+            "2", "old summary", "2022-01-01T00:00:00.000+0000", datetime(2023, 3, 2)
+        ),
+    )
+    job = calculate(headers, incremental=True)
+    assert job["done"] == 2
+    assert statistics_collection.find_one({"_id": "Apache-2"})["summary"] == (
+        "old summary"
+    )
+    assert statistics_watermarks_collection.find_one({"_id": "Apache"}) == {
+        "_id": "Apache",
+        "downloaded_at": datetime(2023, 3, 2),
+    }
+    write_issues(
+        "Apache",
+        [make_issue("5", "summary", "2022-01-01T00:00:00.000+0000", None)],
+    )
+    job = calculate(headers, incremental=True)
+    assert job["done"] == 2
+    assert statistics_collection.find_one({"_id": "Apache-5"}) is not None
+    assert statistics_watermarks_collection.find_one({"_id": "Apache"})[
+        "downloaded_at"
+    ] > datetime(2023, 3, 2)
+    job = calculate(headers, incremental=True)
+    assert job["done"] == 1
+
+    # Issues without a download time are always recalculated
+    jira_repos_db["Apache"].insert_one(
+        {"id": "6", "key": "CASSANDRA-6", "fields": {"summary": "summary"}}
+    )
+    job = calculate(headers, incremental=True)
+    assert job["done"] == 2
+    job = calculate(headers, incremental=True)
+    assert job["done"] == 2
+
+    # Watermarks of fields.updated lead to a full calculation
+    statistics_watermarks_collection.replace_one(
+        {"_id": "Apache"}, {"updated": datetime(2023, 3, 1)}
+    )
+    job = calculate(headers, incremental=True)
+    assert job["done"] == 4
+
+    restore_dbs()
+
+
+def test_statistics_builders():
+    restore_dbs()
+    setup_users_db()
+    setup_db()
+    # Missing and null fields must be handled like the Python builder does
+    jira_repos_db["Apache"].insert_one(
+        {
+            "id": "4",
+            "key": "CASSANDRA-4",
+            "fields": {
+                "resolution": {"name": "Fixed"},
+                "subtasks": None,
+                "attachment": [],
+                "watches": None,
+                "comment": {"comments": []},
+            },
+        }
+    )
+    headers = get_auth_header()
+
+    assert calculate(headers, builder="python")["status"] == "completed"
+    expected = list(statistics_collection.find({}).sort("_id"))
+    for builder in ["aggregation", "processes"]:
+        statistics_collection.delete_many({})
+        assert calculate(headers, builder=builder)["status"] == "completed"
+        assert list(statistics_collection.find({}).sort("_id")) == expected
+
+    response = client.post("/statistics/calculate?builder=other", headers=headers)
+    assert response.status_code == 422
+
+    restore_dbs()
+
+
+def test_get_statistics_fields():
+    restore_dbs()
+    statistics_collection.insert_many(
+        [
+            {"_id": "Apache-1", "issue_type": "Bug", "status": "Open", "votes": 1},
+            {"_id": "Apache-2", "issue_type": "Task", "status": "Closed", "votes": 2},
+        ]
+    )
+
+    response = client.request(
+        "GET",
+        "/statistics",
+        json={
+            "issue_ids": ["Apache-1", "Apache-2"],
+            "fields": ["issue_type", "status"],
+        },
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "data": {
+            "Apache-1": {"issue_type": "Bug", "status": "Open"},
+            "Apache-2": {"issue_type": "Task", "status": "Closed"},
+        }
+    }
+
+    response = client.request(
+        "GET", "/statistics", json={"issue_ids": ["Apache-1"], "fields": []}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"data": {"Apache-1": {}}}
+
+    response = client.request(
+        "GET", "/statistics", json={"issue_ids": ["Apache-1"], "fields": ["other"]}
+    )
+    assert response.status_code == 422
+
+    restore_dbs()
+
+
+def test_aggregate_statistics():
+    restore_dbs()
+    setup_users_db()
+    setup_db()
+    for issue_id, tags in [("Apache-1", ["tag"]), ("Apache-2", ["tag", "other"])]:
+        issue_labels_collection.insert_one(
+            {
+                "_id": issue_id,
+                "existence": None,
+                "property": None,
+                "executive": None,
+                "tags": tags,
+            }
+        )
+    headers = get_auth_header()
+    assert calculate(headers)["status"] == "completed"
+
+    response = client.request("GET", "/statistics/aggregate", json={})
+    assert response.status_code == 200
+    assert response.json() == {
+        "total": 2,
+        "issue_type": [{"value": "Bug", "count": 2}],
+        "status": [{"value": "Open", "count": 2}],
+        "resolution": [{"value": None, "count": 2}],
+        "repo": [{"value": "Apache", "count": 2}],
+        "month_created": [{"value": "2023-01", "count": 2}],
+    }
+
+    response = client.request(
+        "GET", "/statistics/aggregate", json={"tags": ["tag", "other"]}
+    )
+    assert response.json()["total"] == 1
+    response = client.request(
+        "GET",
+        "/statistics/aggregate",
+        json={"issue_ids": ["Apache-1", "Apache-2"], "tags": ["other"]},
+    )
+    assert response.json()["total"] == 1
+    response = client.request("GET", "/statistics/aggregate", json={"issue_ids": []})
+    assert response.json()["total"] == 0
+
+    # Cached until the statistics are calculated again
+    jira_repos_db["Apache"].update_one(
+        {"id": "1"}, {"$set": {"fields.status": {"name": "Closed"}}}
+    )
+    response = client.request("GET", "/statistics/aggregate", json={})
+    assert response.json()["status"] == [{"value": "Open", "count": 2}]
+    assert calculate(headers)["status"] == "completed"
+    response = client.request("GET", "/statistics/aggregate", json={})
+    assert response.json()["status"] == [
+        {"value": "Closed", "count": 1},
+        {"value": "Open", "count": 1},
+    ]
+
+    # Requests with issue_ids are not cached
+    response = client.request(
+        "GET", "/statistics/aggregate", json={"issue_ids": ["Apache-1"]}
+    )
+    assert response.json()["status"] == [{"value": "Closed", "count": 1}]
+    statistics_collection.update_one(
+        {"_id": "Apache-1"}, {"$set": {"status": "Resolved"}}
+    )
+    response = client.request(
+        "GET", "/statistics/aggregate", json={"issue_ids": ["Apache-1"]}
+    )
+    assert response.json()["status"] == [{"value": "Resolved", "count": 1}]
+
+    # Changing tags only drops the results that are filtered by tags
+    response = client.request(
+        "GET", "/statistics/aggregate", json={"tags": ["tag", "other"]}
+    )
+    assert response.json()["total"] == 1
+    issue_labels_collection.update_one(
+        {"_id": "Apache-1"}, {"$set": {"tags": ["tag", "other"]}}
+    )
+    invalidate_issue_labels_counts()
+    response = client.request(
+        "GET", "/statistics/aggregate", json={"tags": ["other", "tag"]}
+    )
+    assert response.json()["total"] == 2
+    response = client.request("GET", "/statistics/aggregate", json={})
+    assert response.json()["status"] == [
+        {"value": "Closed", "count": 1},
+        {"value": "Open", "count": 1},
+    ]
+
+    restore_dbs()
@@ -1,15 +1,19 @@
 import pytest
 from app.dependencies import (
+    create_predictions_collection,
     issue_labels_collection,
     jira_repos_db,
     models_collection,
     repo_info_collection,
+    tags_collection,
 )
+from app.predictions import CollectionPredictionStore, EmbeddedPredictionStore
 from bson import ObjectId
 from fastapi import HTTPException
 
-from .test_util import restore_dbs
-from .ui import get_ui_data, Query
+from . import ui
+from .test_util import client, get_auth_header, restore_dbs, setup_users_db
+from .ui import get_ui_data, Query, _tags_in_filter
 
 
 def setup_db():
@@ -190,7 +194,11 @@ def test_ui():
     }
 
     # Test sort ascending
-    expected_response = {"data": [response_issue1, response_issue2], "total_pages": 1}
+    expected_response = {
+        "data": [response_issue1, response_issue2],
+        "total_pages": 1,
+        "continuation_token": None,
+    }
     payload = Query(
         filter={},
         sort=f"predictions.{model_id}-{version_id}.existence.confidence",
@@ -202,7 +210,11 @@ def test_ui():
     assert get_ui_data(payload) == expected_response
 
     # Test sort descending
-    expected_response = {"data": [response_issue2, response_issue1], "total_pages": 1}
+    expected_response = {
+        "data": [response_issue2, response_issue1],
+        "total_pages": 1,
+        "continuation_token": None,
+    }
     payload = Query(
         filter={},
         sort=f"predictions.{model_id}-{version_id}.existence.confidence",
@@ -214,7 +226,11 @@ def test_ui():
     assert get_ui_data(payload) == expected_response
 
     # Test no sort
-    expected_response = {"data": [response_issue1, response_issue2], "total_pages": 1}
+    expected_response = {
+        "data": [response_issue1, response_issue2],
+        "total_pages": 1,
+        "continuation_token": None,
+    }
     payload = Query(
         filter={},
         sort=None,
@@ -226,7 +242,11 @@ def test_ui():
     assert get_ui_data(payload) == expected_response
 
     # Test filter
-    expected_response = {"data": [response_issue1], "total_pages": 1}
+    expected_response = {
+        "data": [response_issue1],
+        "total_pages": 1,
+        "continuation_token": None,
+    }
     payload = Query(
         filter={"tags": "HADOOP"},
         sort=f"predictions.{model_id}-{version_id}.existence.confidence",
@@ -238,7 +258,11 @@ def test_ui():
     assert get_ui_data(payload) == expected_response
 
     # Test page and limit
-    expected_response = {"data": [response_issue1], "total_pages": 2}
+    expected_response = {
+        "data": [response_issue1],
+        "total_pages": 2,
+        "continuation_token": None,
+    }
     payload = Query(
         filter={},
         sort=f"predictions.{model_id}-{version_id}.existence.confidence",
@@ -250,7 +274,11 @@ def test_ui():
     assert get_ui_data(payload) == expected_response
 
     # Test second page
-    expected_response = {"data": [response_issue2], "total_pages": 2}
+    expected_response = {
+        "data": [response_issue2],
+        "total_pages": 2,
+        "continuation_token": None,
+    }
     payload = Query(
         filter={},
         sort=f"predictions.{model_id}-{version_id}.existence.confidence",
@@ -288,3 +316,164 @@ def test_ui():
         get_ui_data(payload)
 
     restore_dbs()
+
+
+def test_ui_estimated_total_pages():
+    assert _tags_in_filter({}) == []
+    assert _tags_in_filter({"tags": "HADOOP"}) == ["HADOOP"]
+    assert _tags_in_filter(
+        {"$and": [{"tags": "HADOOP"}, {"tags": {"$eq": "has-label"}}]}
+    ) == ["HADOOP", "has-label"]
+    assert _tags_in_filter({"tags": {"$ne": "HADOOP"}}) is None
+    assert _tags_in_filter({"existence": True}) is None
+
+    restore_dbs()
+    model_id, version_id, _, _ = setup_db()
+    payload = Query(
+        filter={"tags": "HADOOP"},
+        sort=None,
+        sort_ascending=True,
+        models=[],
+        page=1,
+        limit=1,
+        estimate_total=True,
+    )
+    assert get_ui_data(payload).total_pages == 1
+
+    exact_payload = payload.copy(update={"estimate_total": False})
+    assert get_ui_data(exact_payload).total_pages == 1
+
+    # The cached counts are invalidated when tags are added through the API
+    setup_users_db()
+    tags_collection.insert_one(
+        {"_id": "HADOOP", "description": "text", "type": "manual-tag"}
+    )
+    response = client.post(
+        "/bulk/add-tags",
+        headers=get_auth_header(),
+        json={"data": [{"issue_id": "Apache-2", "tags": ["HADOOP"]}]},
+    )
+    assert response.status_code == 200
+    assert get_ui_data(payload).total_pages == 2
+    assert get_ui_data(exact_payload).total_pages == 2
+
+    restore_dbs()
+
+
+@pytest.mark.parametrize("storage", ["embedded", "collection"])
+def test_ui_prediction_stores(storage, monkeypatch):
+    restore_dbs()
+    model_id, version_id, _, _ = setup_db()
+    model = f"{model_id}-{version_id}"
+    models_collection.insert_one(
+        {
+            "_id": model_id,
+            "name": "model_name",
+            "config": {"key": "value"},
+            "versions": {str(version_id): {"description": "version description"}},
+            "performances": {},
+        }
+    )
+    # The predictions are written through the store, Apache-3 has none
+    issue_labels_collection.update_many({}, {"$set": {"predictions": {}}})
+    issue_labels_collection.insert_one(
+        {
+            "_id": "Apache-3",
+            "existence": None,
+            "property": None,
+            "executive": None,
+            "tags": ["HADOOP"],
+            "comments": {},
+            "predictions": {},
+        }
+    )
+    jira_repos_db["Apache"].insert_one(
+        {
+            "id": "3",
+            "key": "HADOOP-2",
+            "fields": {"summary": "Summary", "description": "Description"},
+        }
+    )
+    if storage == "collection":
+        create_predictions_collection()
+        store = CollectionPredictionStore()
+    else:
+        store = EmbeddedPredictionStore()
+    monkeypatch.setattr(ui, "prediction_store", store)
+
+    def prediction(confidence: float):
+        return {"existence": {"prediction": False, "confidence": confidence}}
+
+    store.write(
+        str(model_id),
+        str(version_id),
+        [("Apache-1", prediction(0.42)), ("Apache-2", prediction(0.43))],
+    )
+    store.create_indexes(str(model_id), str(version_id), {"existence"})
+
+    def query(**kwargs):
+        return Query(
+            **{
+                "filter": {},
+                "sort": f"predictions.{model}.existence.confidence",
+                "sort_ascending": True,
+                "models": [model],
+                "page": 1,
+                "limit": 1,
+                **kwargs,
+            }
+        )
+
+    def page_ids(**kwargs):
+        response = get_ui_data(query(**kwargs))
+        ids = []
+        for page in range(1, response.total_pages + 1):
+            ids.extend(
+                issue.issue_id for issue in get_ui_data(query(page=page, **kwargs)).data
+            )
+        return response.total_pages, ids
+
+    def keyset_ids(**kwargs):
+        ids = []
+        token = None
+        while True:
+            response = get_ui_data(query(page=None, continuation_token=token, **kwargs))
+            ids.extend(issue.issue_id for issue in response.data)
+            token = response.continuation_token
+            if token is None:
+                return ids
+
+    # Only the embedded store pages over issues without predictions, which sort
+    # first. The page count matches the issues that are paged over.
+    if storage == "embedded":
+        expected = ["Apache-3", "Apache-1", "Apache-2"]
+    else:
+        expected = ["Apache-1", "Apache-2"]
+    assert page_ids() == (len(expected), expected)
+    assert keyset_ids() == expected
+    assert page_ids(sort_ascending=False) == (len(expected), expected[::-1])
+    assert keyset_ids(sort_ascending=False) == expected[::-1]
+    expected_hadoop = [id_ for id_ in expected if id_ != "Apache-2"]
+    assert page_ids(filter={"tags": "HADOOP"}) == (
+        len(expected_hadoop),
+        expected_hadoop,
+    )
+
+    data = get_ui_data(query()).data
+    assert data[0].predictions == (
+        {} if storage == "embedded" else {model: prediction(0.42)}
+    )
+
+    # Without a sort on predictions, all issues are paged over
+    assert page_ids(sort=None) == (3, ["Apache-1", "Apache-2", "Apache-3"])
+
+    # Filters on predictions only work when they are stored in IssueLabels
+    prediction_filter = {f"predictions.{model}.existence.confidence": {"$gt": 0.425}}
+    if storage == "embedded":
+        assert page_ids(sort=None, filter=prediction_filter) == (1, ["Apache-2"])
+    else:
+        with pytest.raises(HTTPException) as exc_info:
+            get_ui_data(query(sort=None, filter=prediction_filter))
+        assert exc_info.value.status_code == 422
+
+    restore_dbs()
@@ -1,5 +1,8 @@
 from app import app
+from app.cache import invalidate_issue_labels_counts, invalidate_statistics_aggregates
 from app.dependencies import (
+    PREDICTIONS_STORAGE,
+    create_predictions_collection,
     users_collection,
     issue_labels_collection,
     models_collection,
@@ -11,6 +14,10 @@ from app.dependencies import (
     mongo_client,
     files_collection,
     repo_info_collection,
+    predictions_collection,
+    jobs_collection,
+    statistics_collection,
+    statistics_watermarks_collection,
 )
 from app.schemas import (
     issue_labels_collection_schema,
@@ -21,8 +28,10 @@ from app.schemas import (
     users_collection_schema,
     files_collection_schema,
     repo_info_collection_schema,
+    jobs_collection_schema,
 )
 from fastapi.testclient import TestClient
+from time import sleep
 
 from .authentication import get_password_hash
 
@@ -50,6 +59,12 @@ def restore_dbs():
     mining_add_db["fs_chunks"].drop()
     embeddings_collection.drop()
     files_collection.drop()
+    predictions_collection.drop()
+    jobs_collection.drop()
+    statistics_collection.drop()
+    statistics_watermarks_collection.drop()
+    invalidate_issue_labels_counts()
+    invalidate_statistics_aggregates()
 
     mining_add_db.create_collection(
         "IssueLabels", validator=issue_labels_collection_schema
@@ -62,6 +77,9 @@ def restore_dbs():
         "DLEmbeddings", validator=embeddings_collection_schema
     )
     mining_add_db.create_collection("Files", validator=files_collection_schema)
+    if PREDICTIONS_STORAGE == "collection":
+        create_predictions_collection()
+    mining_add_db.create_collection("Jobs", validator=jobs_collection_schema)
     mongo_client["Users"].create_collection("Users", validator=users_collection_schema)
 
 
@@ -127,3 +145,12 @@ def auth_test_put(endpoint: str, payload=None):
 def auth_test_delete(endpoint: str):
     response = client.delete(endpoint)
     assert response.status_code == 401
+
+
+def wait_for_job(job_id: str, timeout: float = 30.0):
+    for _ in range(int(timeout / 0.1)):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed", "cancelled"):
+            return job
+        sleep(0.1)
+    raise TimeoutError(f"Job {job_id} did not finish within {timeout} seconds")
@@ -1,3 +1,7 @@
+import base64
+import binascii
+import json
+
 from fastapi import APIRouter
 from pydantic import BaseModel
 from app.dependencies import (
@@ -6,8 +10,12 @@ from app.dependencies import (
     models_collection,
     repo_info_collection,
 )
+from app.cache import issue_labels_counts, normalize_filter
+from app.encoding import dumps
+from app.predictions import prediction_store
 from app.exceptions import (
     ui_sort_exception,
+    invalid_continuation_token_exception,
     version_not_specified_exception,
     model_not_found_exception,
     version_not_found_exception,
@@ -23,8 +31,10 @@ class Query(BaseModel):
     sort: str | None
     sort_ascending: bool
     models: list[str]
-    page: int
+    page: int | None
     limit: int
+    continuation_token: str | None
+    estimate_total: bool = False
 
     class Config:
         schema_extra = {
@@ -35,6 +45,8 @@ class Query(BaseModel):
                 "models": ["model_id-version_id"],
                 "page": 42,
                 "limit": 42,
+                "continuation_token": None,
+                "estimate_total": False,
             }
         }
 
@@ -60,6 +72,7 @@ class UIData(BaseModel):
 class UIDataOut(BaseModel):
     data: list[UIData]
     total_pages: int
+    continuation_token: str | None
 
     class Config:
         schema_extra = {
@@ -91,55 +104,202 @@ class UIDataOut(BaseModel):
                     }
                 ],
                 "total_pages": 42,
+                "continuation_token": "string",
             }
         }
 
 
+def _tags_in_filter(filter_: dict) -> list[str] | None:
+    """
+    Returns the tags of a filter that only requires tags to be present, such as
+    {"$and": [{"tags": "a"}, {"tags": {"$eq": "b"}}]}, or None for other filters.
+    """
+    if not filter_:
+        return []
+    if filter_.keys() == {"tags"}:
+        tag = filter_["tags"]
+        if isinstance(tag, dict) and tag.keys() == {"$eq"}:
+            tag = tag["$eq"]
+        return [tag] if isinstance(tag, str) else None
+    if filter_.keys() == {"$and"} and isinstance(filter_["$and"], list):
+        tags = []
+        for sub_filter in filter_["$and"]:
+            sub_tags = _tags_in_filter(sub_filter)
+            if sub_tags is None:
+                return None
+            tags.extend(sub_tags)
+        return tags
+    return None
+
+
+def _get_tag_count(tag: str) -> int:
+    return issue_labels_counts.get_or_compute(
+        ("tag_count", tag),
+        lambda: issue_labels_collection.count_documents({"tags": tag}),
+    )
+
+
+def _count_issues(filter_: dict, sort: str | None, estimate: bool) -> int:
+    """
+    Counts the issues matching the filter. Counts are cached for a short time
+    and invalidated on writes to IssueLabels. When estimating, tag-only filters
+    are answered from cached per-tag counts: exact for a single tag and an
+    upper bound for multiple tags. Each tag is counted on the tags index. When
+    the prediction store only pages over the issues with predictions of the
+    sorted model version, those are counted instead.
+    """
+    if sort is not None:
+        count = issue_labels_counts.get_or_compute(
+            ("sorted_count", normalize_filter(filter_), sort),
+            lambda: prediction_store.count_issues(filter_, [(sort, 1)]),
+        )
+        if count is not None:
+            return count
+    if estimate:
+        tags = _tags_in_filter(filter_)
+        if tags == []:
+            return issue_labels_counts.get_or_compute(
+                ("estimated_count",), issue_labels_collection.estimated_document_count
+            )
+        if tags is not None:
+            return min(_get_tag_count(tag) for tag in tags)
+    return issue_labels_counts.get_or_compute(
+        ("count", normalize_filter(filter_)),
+        lambda: issue_labels_collection.count_documents(filter_),
+    )
+
+
+def _get_sort_value(issue: dict, sort: str):
+    value = issue
+    for key in sort.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _encode_continuation_token(sort_value, last_id: str) -> str:
+    return base64.urlsafe_b64encode(dumps([sort_value, last_id])).decode("ascii")
+
+
+def _decode_continuation_token(token: str):
+    try:
+        sort_value, last_id = json.loads(base64.urlsafe_b64decode(token))
+    except (binascii.Error, ValueError, TypeError):
+        raise invalid_continuation_token_exception(token)
+    return sort_value, last_id
+
+
+def _keyset_filter(sort: str | None, sort_direction: int, token: str):
+    """
+    Returns the range predicate that seeks past the last issue of the previous
+    page, given the sort order (sort, _id). Missing sort values sort before all
+    other values in MongoDB, so they come first ascending and last descending.
+    """
+    sort_value, last_id = _decode_continuation_token(token)
+    op = "$gt" if sort_direction == 1 else "$lt"
+    if sort is None:
+        return {"_id": {op: last_id}}
+    same_value = {sort: sort_value, "_id": {op: last_id}}
+    if sort_value is None:
+        if sort_direction == 1:
+            return {"$or": [same_value, {sort: {"$ne": None}}]}
+        return same_value
+    if sort_direction == 1:
+        return {"$or": [{sort: {op: sort_value}}, same_value]}
+    return {"$or": [{sort: {op: sort_value}}, same_value, {sort: None}]}
+
+
 @router.post("", response_model=UIDataOut)
 def get_ui_data(request: Query):
-    page = request.page - 1
+    """
+    Returns a page of issues for the labelling UI. Pages are selected either by
+    page number, or by setting page to null and passing the continuation_token
+    of the previous response (null for the first page). The continuation tokens
+    seek directly to the next page, so deep pages are as cheap as the first one.
+    Set estimate_total to compute total_pages from cached tag counts when the
+    filter only selects on tags.
+    """
+    prediction_store.check_filter(request.filter)
+    keyset_mode = request.page is None or request.continuation_token is not None
     limit = request.limit
     total_pages = math.ceil(
-        issue_labels_collection.count_documents(request.filter) / limit
+        _count_issues(request.filter, request.sort, request.estimate_total) / limit
     )
 
+    # Validate all requested model versions with one query
+    model_versions = []
     for model in request.models:
         if len(model.split("-")) != 2:
             raise version_not_specified_exception(model)
-        model_id = model.split("-")[0]
-        version_id = model.split("-")[1]
-        db_model = models_collection.find_one({"_id": ObjectId(model_id)})
-        if db_model is None:
+        model_versions.append(tuple(model.split("-")))
+    db_models = {
+        str(db_model["_id"]): db_model
+        for db_model in models_collection.find(
+            {"_id": {"$in": [ObjectId(model_id) for model_id, _ in model_versions]}},
+            ["versions"],
+        )
+    }
+    for model_id, version_id in model_versions:
+        if model_id not in db_models:
             raise model_not_found_exception(model_id)
-        if version_id not in db_model["versions"]:
+        if version_id not in db_models[model_id]["versions"]:
             raise version_not_found_exception(version_id, model_id)
 
-    if request.sort is not None:
-        sort_direction = 1 if request.sort_ascending else -1
-        issues = (
-            issue_labels_collection.find(request.filter)
-            .sort(request.sort, sort_direction)
-            .skip(page * limit)
-            .limit(limit)
+    sort_direction = 1 if request.sort_ascending else -1
+    if keyset_mode:
+        seek_filter = None
+        if request.continuation_token is not None:
+            seek_filter = _keyset_filter(
+                request.sort, sort_direction, request.continuation_token
+            )
+        sort = [("_id", sort_direction)]
+        if request.sort is not None:
+            sort.insert(0, (request.sort, sort_direction))
+        issues = prediction_store.find_issues(
+            request.filter, sort, limit, seek_filter=seek_filter
         )
     else:
-        issues = (
-            issue_labels_collection.find(request.filter).skip(page * limit).limit(limit)
+        sort = None
+        if request.sort is not None:
+            sort = [(request.sort, sort_direction)]
+        issues = prediction_store.find_issues(
+            request.filter, sort, limit, skip=(request.page - 1) * limit
         )
 
-    response = []
+    continuation_token = None
+    if keyset_mode and len(issues) == limit:
+        last_issue = issues[-1]
+        sort_value = None
+        if request.sort is not None:
+            sort_value = _get_sort_value(last_issue, request.sort)
+        continuation_token = _encode_continuation_token(sort_value, last_issue["_id"])
+
+    # Fetch the Jira data with one query per repo and the link prefixes at once
+    ids = dict()
     for issue in issues:
-        issue_data = jira_repos_db[issue["_id"].split("-")[0]].find_one(
-            {"id": issue["_id"].split("-")[1]},
-            ["key", "fields.summary", "fields.description"],
+        split_id = issue["_id"].split("-")
+        ids.setdefault(split_id[0], []).append(split_id[1])
+    issues_data = dict()
+    for jira_name, repo_ids in ids.items():
+        for issue_data in jira_repos_db[jira_name].find(
+            {"id": {"$in": repo_ids}},
+            ["id", "key", "fields.summary", "fields.description"],
+        ):
+            issues_data[f'{jira_name}-{issue_data["id"]}'] = issue_data
+    issue_link_prefixes = {
+        repo_info["_id"]: repo_info["issue_link_prefix"]
+        for repo_info in repo_info_collection.find(
+            {"_id": {"$in": list(ids)}}, ["issue_link_prefix"]
         )
-        issue_link_prefix = repo_info_collection.find_one(
-            {"_id": issue["_id"].split("-")[0]}
-        )["issue_link_prefix"]
-        predictions = {}
-        for model in request.models:
-            if "predictions" in issue and model in issue["predictions"]:
-                predictions[model] = issue["predictions"][model]
+    }
+
+    predictions = prediction_store.get_for_issues(issues, request.models)
+
+    response = []
+    for issue in issues:
+        issue_data = issues_data[issue["_id"]]
+        issue_link_prefix = issue_link_prefixes[issue["_id"].split("-")[0]]
         response.append(
             UIData(
                 issue_id=issue["_id"],
@@ -152,9 +312,11 @@ def get_ui_data(request: Query):
                     property=issue["property"],
                     executive=issue["executive"],
                 ),
-                predictions=predictions,
+                predictions=predictions[issue["_id"]],
                 tags=issue["tags"],
                 comments=issue["comments"],
             )
         )
-    return UIDataOut(data=response, total_pages=total_pages)
+    return UIDataOut(
+        data=response, total_pages=total_pages, continuation_token=continuation_token
+    )
@@ -152,6 +152,47 @@ issue_labels_collection_schema = {
 }
 
 
+predictions_collection_schema = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "additionalProperties": False,
+        "required": ["issue_id", "model_id", "version_id", "predictions"],
+        "properties": {
+            "_id": {"bsonType": "objectId", "description": "'_id' must be a objectId"},
+            "issue_id": {
+                "bsonType": "string",
+                "description": "'issue_id' must be a string",
+            },
+            "model_id": {
+                "bsonType": "string",
+                "description": "'model_id' must be a string",
+            },
+            "version_id": {
+                "bsonType": "string",
+                "description": "'version_id' must be a string",
+            },
+            "predictions": {
+                "bsonType": "object",
+                "additionalProperties": {
+                    "bsonType": "object",
+                    "required": ["prediction", "confidence"],
+                    "properties": {
+                        "prediction": {
+                            "bsonType": "bool",
+                            "description": "'prediction' must be a bool",
+                        },
+                        "confidence": {
+                            "bsonType": "double",
+                            "description": "'confidence' must be a double",
+                        },
+                    },
+                },
+            },
+        },
+    }
+}
+
+
 repo_info_collection_schema = {
     "$jsonSchema": {
         "bsonType": "object",
@@ -178,6 +219,34 @@ repo_info_collection_schema = {
                 "bsonType": "string",
                 "description": "'issue_link_prefix' must be a string",
             },
+            "fields": {
+                "bsonType": ["array", "null"],
+                "items": {"bsonType": "string"},
+                "description": "'fields' must be an array of strings",
+            },
+            "changelog": {
+                "bsonType": "bool",
+                "description": "'changelog' must be a bool",
+            },
+            "checkpoint": {
+                "bsonType": "object",
+                "additionalProperties": False,
+                "required": ["query", "start_at", "download_date"],
+                "properties": {
+                    "query": {
+                        "bsonType": "string",
+                        "description": "'query' must be a string",
+                    },
+                    "start_at": {
+                        "bsonType": ["int", "long"],
+                        "description": "'start_at' must be an int",
+                    },
+                    "download_date": {
+                        "bsonType": "string",
+                        "description": "'download_date' must be a string",
+                    },
+                },
+            },
         },
     }
 }
@@ -233,3 +302,69 @@ users_collection_schema = {
         },
     }
 }
+
+jobs_collection_schema = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "additionalProperties": False,
+        "required": ["name", "status", "total", "done", "cancel_requested"],
+        "properties": {
+            "_id": {"bsonType": "objectId", "description": "'_id' must be a objectId"},
+            "name": {"bsonType": "string", "description": "'name' must be a string"},
+            "status": {
+                "enum": ["pending", "running", "completed", "failed", "cancelled"],
+                "description": "'status' must be a valid job status",
+            },
+            "total": {
+                "bsonType": ["int", "long"],
+                "description": "'total' must be an int",
+            },
+            "done": {
+                "bsonType": ["int", "long"],
+                "description": "'done' must be an int",
+            },
+            "cancel_requested": {
+                "bsonType": "bool",
+                "description": "'cancel_requested' must be a bool",
+            },
+            "error": {
+                "bsonType": ["string", "null"],
+                "description": "'error' must be a string",
+            },
+            "created_at": {
+                "bsonType": "date",
+                "description": "'created_at' must be a date",
+            },
+            "started_at": {
+                "bsonType": ["date", "null"],
+                "description": "'started_at' must be a date",
+            },
+            "finished_at": {
+                "bsonType": ["date", "null"],
+                "description": "'finished_at' must be a date",
+            },
+            "owner": {
+                "bsonType": "object",
+                "required": ["host", "pid", "instance_id"],
+                "properties": {
+                    "host": {
+                        "bsonType": "string",
+                        "description": "'host' must be a string",
+                    },
+                    "pid": {
+                        "bsonType": ["int", "long"],
+                        "description": "'pid' must be an int",
+                    },
+                    "instance_id": {
+                        "bsonType": "string",
+                        "description": "'instance_id' must be a string",
+                    },
+                },
+            },
+            "heartbeat_at": {
+                "bsonType": "date",
+                "description": "'heartbeat_at' must be a date",
+            },
+        },
+    }
+}
@@ -1,3 +1,7 @@
+import collections
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import HTTPException
 from pymongo.errors import DuplicateKeyError
 
@@ -10,6 +14,76 @@ def read_file_in_chunks(file):
         yield chunk
 
 
+def split_in_chunks(items: list, chunk_size: int):
+    for start in range(0, len(items), chunk_size):
+        yield items[start : start + chunk_size]
+
+
+# Number of operations sent in a single bulk_write
+BULK_WRITE_BATCH_SIZE = 1000
+
+
+def iter_batches(items, batch_size: int):
+    """
+    Yields lists of at most batch_size items from any iterable.
+    """
+    items = iter(items)
+    while batch := list(itertools.islice(items, batch_size)):
+        yield batch
+
+
+def bulk_write_in_batches(collection, operations, batch_size=BULK_WRITE_BATCH_SIZE):
+    """
+    Sends the operations (any iterable) as unordered bulk_write batches and
+    returns the summed matched, modified and upserted counts.
+    """
+    counts = {"matched_count": 0, "modified_count": 0, "upserted_count": 0}
+    for batch in iter_batches(operations, batch_size):
+        result = collection.bulk_write(batch, ordered=False)
+        counts["matched_count"] += result.matched_count
+        counts["modified_count"] += result.modified_count
+        counts["upserted_count"] += result.upserted_count
+    return counts
+
+
+def find_missing_ids(collection, ids) -> list:
+    """
+    Returns the ids that do not exist in the collection, using a single query.
+    """
+    ids = set(ids)
+    if not ids:
+        return []
+    existing_ids = {
+        item["_id"] for item in collection.find({"_id": {"$in": list(ids)}}, ["_id"])
+    }
+    return list(ids - existing_ids)
+
+
+def prefetch_in_order(tasks, max_workers: int):
+    """
+    Runs the given callables on a thread pool and yields their results in the
+    order of the tasks. At most max_workers results are in flight at any time,
+    so memory stays bounded while the consumer is still reading.
+    """
+    tasks = iter(tasks)
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for task in tasks:
+                pending.append(executor.submit(task))
+                if len(pending) >= max_workers:
+                    break
+            while pending:
+                result = pending.popleft().result()
+                task = next(tasks, None)
+                if task is not None:
+                    pending.append(executor.submit(task))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
 def find_one(collection, _id, name):
     item = collection.find_one({"_id": _id})
     if item is None:
@@ -0,0 +1,86 @@
+"""
+Compares the sequential per-repo fetch of /issue-data with the chunked,
+concurrent fetch engine on a synthetic multi-repo dataset.
+
+Run from the issues-db-api directory against a local mongod:
+    python -m benchmarks.issue_data
+"""
+
+from app.dependencies import jira_repos_db
+from app.routers.issue_data import fetch_repo_issues
+from benchmarks.util import time_it, print_result
+
+NUM_REPOS = 16
+NUM_REQUESTED_REPOS = 4
+ISSUES_PER_REPO = 50000
+
+
+def setup_dataset():
+    issue_ids = []
+    for repo_idx in range(NUM_REPOS):
+        collection = jira_repos_db[f"Benchmark{repo_idx}"]
+        collection.drop()
+        collection.insert_many(
+            [
+                {
+                    "id": str(issue_idx),
+                    "key": f"PROJECT-{issue_idx}",
+                    "fields": {"summary": f"Summary {issue_idx}"},
+                }
+                for issue_idx in range(ISSUES_PER_REPO)
+            ]
+        )
+        collection.create_index("id")
+        if repo_idx < NUM_REQUESTED_REPOS:
+            issue_ids.extend(
+                f"Benchmark{repo_idx}-{issue_idx}"
+                for issue_idx in range(ISSUES_PER_REPO)
+            )
+    return issue_ids
+
+
+def teardown_dataset():
+    for repo_idx in range(NUM_REPOS):
+        jira_repos_db[f"Benchmark{repo_idx}"].drop()
+
+
+def sequential_fetch(issue_ids):
+    ids = dict()
+    for jira_name in jira_repos_db.list_collection_names():
+        ids[jira_name] = []
+    for issue_id in issue_ids:
+        split_id = issue_id.split("-")
+        ids[split_id[0]].append(split_id[1])
+    for jira_name in jira_repos_db.list_collection_names():
+        for _ in jira_repos_db[jira_name].find(
+            {"id": {"$in": ids[jira_name]}}, ["id", "key", "fields.summary"]
+        ):
+            pass
+
+
+def concurrent_fetch(issue_ids):
+    ids = dict()
+    for issue_id in issue_ids:
+        split_id = issue_id.split("-")
+        ids.setdefault(split_id[0], []).append(split_id[1])
+    for _ in fetch_repo_issues(ids, ["id", "key", "fields.summary"]):
+        pass
+
+
+def main():
+    issue_ids = setup_dataset()
+    try:
+        print(f"{len(issue_ids)} issues from {NUM_REQUESTED_REPOS}/{NUM_REPOS} repos")
+        baseline = time_it(lambda: sequential_fetch(issue_ids))
+        print_result("sequential per-repo $in", baseline)
+        print_result(
+            "chunked concurrent fetch",
+            time_it(lambda: concurrent_fetch(issue_ids)),
+            baseline,
+        )
+    finally:
+        teardown_dataset()
+
+
+if __name__ == "__main__":
+    main()
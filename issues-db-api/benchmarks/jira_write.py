@@ -0,0 +1,101 @@
+"""
+Measures the time of one flush of downloaded Jira issues, comparing the former
+per-issue find_one/update_one round trips with the bulk upserts of write_issues.
+
+Run from the issues-db-api directory against a local mongod:
+    python -m benchmarks.jira_write
+"""
+
+from app.dependencies import (
+    create_jira_repo_indexes,
+    issue_labels_collection,
+    jira_repos_db,
+)
+from app.jirarepos_download import write_issues
+from benchmarks.util import time_it, print_result
+
+REPO = "Benchmark"
+NUM_ISSUES = 10000
+# Fraction of the flushed issues that already exist, as in an update
+EXISTING_FRACTION = 0.5
+
+
+def make_issues(key):
+    return [
+        {
+            "id": str(idx),
+            "key": f"{key}-{idx}",
+            "fields": {"summary": f"Summary {idx}", "description": "Text " * 50},
+        }
+        for idx in range(NUM_ISSUES)
+    ]
+
+
+def setup_dataset():
+    teardown_dataset()
+    create_jira_repo_indexes(REPO)
+    write_issues(REPO, make_issues("OLD")[: int(NUM_ISSUES * EXISTING_FRACTION)])
+
+
+def teardown_dataset():
+    jira_repos_db[REPO].drop()
+    issue_labels_collection.delete_many({"_id": {"$regex": f"^{REPO}-"}})
+
+
+def per_issue_flush(jira_name, issues):
+    collection = jira_repos_db[jira_name]
+    for issue in issues:
+        old_issue = collection.find_one({"id": issue["id"]})
+        if not old_issue:
+            continue
+        old_tag = old_issue["key"].split("-")[0]
+        issue_labels_collection.update_one(
+            {"_id": f"{jira_name}-{issue['id']}"},
+            {"$pull": {"tags": f"{jira_name}-{old_tag}"}},
+        )
+    ids = [issue["id"] for issue in issues]
+    collection.delete_many({"id": {"$in": ids}})
+    collection.insert_many([dict(issue) for issue in issues])
+    for issue in issues:
+        issue_label = issue_labels_collection.find_one(
+            {"_id": f"{jira_name}-{issue['id']}"}
+        )
+        if issue_label is None:
+            issue_labels_collection.insert_one(
+                {
+                    "_id": f"{jira_name}-{issue['id']}",
+                    "existence": None,
+                    "property": None,
+                    "executive": None,
+                    "tags": [],
+                    "comments": {},
+                    "predictions": {},
+                }
+            )
+        new_tag = issue["key"].split("-")[0]
+        issue_labels_collection.update_one(
+            {"_id": f"{jira_name}-{issue['id']}"},
+            {"$addToSet": {"tags": f"{jira_name}-{new_tag}"}},
+        )
+
+
+def timed_flush(flush):
+    setup_dataset()
+    return time_it(lambda: flush(REPO, make_issues("NEW")), repeat=1)
+
+
+def main():
+    try:
+        baseline = timed_flush(per_issue_flush)
+        print_result(f"{NUM_ISSUES} issues: per-issue round trips", baseline)
+        print_result(
+            f"{NUM_ISSUES} issues: bulk upserts",
+            timed_flush(write_issues),
+            baseline,
+        )
+    finally:
+        teardown_dataset()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compares the statistics builders on one repo: the Python builder fetches every
+issue and writes the statistics back, the processes builder does the same on
+STATISTICS_WORKERS processes and the aggregation builder computes them inside
+MongoDB. Reports the wall time and the bytes that the server sent and
+received during each run.
+
+Run from the issues-db-api directory against a local mongod:
+    python -m benchmarks.statistics
+"""
+
+from app.dependencies import jira_repos_db, mongo_client, statistics_collection
+from app.routers.statistics import (
+    STATISTICS_WORKERS,
+    build_with_aggregation,
+    build_with_processes,
+    build_with_python,
+)
+from benchmarks.util import time_it, print_result
+
+REPO = "Benchmark"
+NUM_ISSUES = 10000
+# Changelog entries per issue, which the statistics do not need
+CHANGELOG_SIZE = 20
+
+
+class NoJob:
+    def advance(self, amount=1):
+        pass
+
+    def check_cancelled(self):
+        pass
+
+
+def make_issue(idx):
+    return {
+        "id": str(idx),
+        "key": f"BENCH-{idx}",
+        "fields": {
+            "issuetype": {"name": "Bug"},
+            "status": {"name": "Open"},
+            "created": "2023-01-01T00:00:00.000+0000",
+            "updated": "2023-01-01T00:00:00.000+0000",
+            "subtasks": [{"id": str(idx + 1)}],
+            "attachment": [{"filename": "design.pdf"}],
+            "summary": f"Summary {idx}",
+            "description": "Text " * 100,
+            "comment": {"comments": [{"body": "Comment " * 20}] * 3},
+        },
+        "changelog": {
+            "histories": [{"items": [{"field": "status", "toString": "Open"}]}]
+            * CHANGELOG_SIZE
+        },
+    }
+
+
+def setup_dataset():
+    teardown_dataset()
+    jira_repos_db[REPO].insert_many([make_issue(idx) for idx in range(NUM_ISSUES)])
+
+
+def teardown_dataset():
+    jira_repos_db[REPO].drop()
+    statistics_collection.delete_many({"_id": {"$regex": f"^{REPO}-"}})
+
+
+def network_bytes():
+    network = mongo_client.admin.command("serverStatus")["network"]
+    return network["bytesIn"], network["bytesOut"]
+
+
+def run(build):
+    bytes_in, bytes_out = network_bytes()
+    duration = time_it(lambda: build(NoJob(), REPO, {}, NUM_ISSUES), repeat=1)
+    new_bytes_in, new_bytes_out = network_bytes()
+    return duration, new_bytes_in - bytes_in, new_bytes_out - bytes_out
+
+
+def build_with_processes_for_repo(job, repo, filter_, count):
+    build_with_processes(job, {repo: filter_}, {repo: count}, lambda repo: None)
+
+
+def main():
+    try:
+        setup_dataset()
+        baseline, python_in, python_out = run(build_with_python)
+        print_result(f"{NUM_ISSUES} issues: python builder", baseline)
+        print(f"    server received {python_in:,} bytes, sent {python_out:,} bytes")
+        duration, processes_in, processes_out = run(build_with_processes_for_repo)
+        print_result(
+            f"{NUM_ISSUES} issues: {STATISTICS_WORKERS} processes", duration, baseline
+        )
+        print(
+            f"    server received {processes_in:,} bytes, sent {processes_out:,} bytes"
+        )
+        duration, aggregation_in, aggregation_out = run(build_with_aggregation)
+        print_result(f"{NUM_ISSUES} issues: aggregation builder", duration, baseline)
+        print(
+            f"    server received {aggregation_in:,} bytes, "
+            f"sent {aggregation_out:,} bytes"
+        )
+    finally:
+        teardown_dataset()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Measures the latency of the /ui endpoint per page size, comparing the former
+per-issue lookups with the batched lookups of get_ui_data.
+
+Run from the issues-db-api directory against a local mongod:
+    python -m benchmarks.ui
+"""
+
+from app.dependencies import (
+    issue_labels_collection,
+    jira_repos_db,
+    repo_info_collection,
+)
+from app.routers.ui import get_ui_data, Query
+from benchmarks.util import time_it, print_result
+
+REPO = "Benchmark"
+TAG = "benchmark-ui"
+NUM_ISSUES = 5000
+PAGE_SIZES = [10, 50, 200]
+
+
+def setup_dataset():
+    jira_repos_db[REPO].drop()
+    jira_repos_db[REPO].insert_many(
+        [
+            {
+                "id": str(idx),
+                "key": f"PROJECT-{idx}",
+                "fields": {"summary": f"Summary {idx}", "description": "Text"},
+            }
+            for idx in range(NUM_ISSUES)
+        ]
+    )
+    jira_repos_db[REPO].create_index("id")
+    repo_info_collection.insert_one(
+        {
+            "_id": REPO,
+            "repo_url": "url_of_repo",
+            "download_date": None,
+            "batch_size": 1000,
+            "query_wait_time_minutes": 0.0,
+            "issue_link_prefix": "https://issues.example.org/jira",
+        }
+    )
+    issue_labels_collection.insert_many(
+        [
+            {
+                "_id": f"{REPO}-{idx}",
+                "existence": None,
+                "property": None,
+                "executive": None,
+                "tags": [TAG],
+                "comments": {},
+                "predictions": {},
+            }
+            for idx in range(NUM_ISSUES)
+        ]
+    )
+
+
+def teardown_dataset():
+    jira_repos_db[REPO].drop()
+    repo_info_collection.delete_one({"_id": REPO})
+    issue_labels_collection.delete_many({"tags": TAG})
+
+
+def per_issue_lookups(request: Query):
+    issues = (
+        issue_labels_collection.find(request.filter)
+        .skip((request.page - 1) * request.limit)
+        .limit(request.limit)
+    )
+    for issue in issues:
+        jira_repos_db[issue["_id"].split("-")[0]].find_one(
+            {"id": issue["_id"].split("-")[1]},
+            ["key", "fields.summary", "fields.description"],
+        )
+        repo_info_collection.find_one({"_id": issue["_id"].split("-")[0]})
+
+
+def main():
+    setup_dataset()
+    try:
+        for page_size in PAGE_SIZES:
+            request = Query(
+                filter={"tags": TAG},
+                sort=None,
+                sort_ascending=True,
+                models=[],
+                page=2,
+                limit=page_size,
+            )
+            baseline = time_it(lambda: per_issue_lookups(request), repeat=5)
+            print_result(f"page size {page_size}: per-issue lookups", baseline)
+            print_result(
+                f"page size {page_size}: batched lookups",
+                time_it(lambda: get_ui_data(request), repeat=5),
+                baseline,
+            )
+    finally:
+        teardown_dataset()
+
+
+if __name__ == "__main__":
+    main()
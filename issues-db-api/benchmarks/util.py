@@ -0,0 +1,22 @@
+from time import perf_counter
+
+
+def time_it(function, repeat=3):
+    """
+    Returns the best wall time in seconds of repeat calls to function.
+    """
+    best = None
+    for _ in range(repeat):
+        start_time = perf_counter()
+        function()
+        duration = perf_counter() - start_time
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def print_result(name, duration, baseline=None):
+    if baseline is None:
+        print(f"{name:<40} {duration * 1000:>10.1f} ms")
+    else:
+        print(f"{name:<40} {duration * 1000:>10.1f} ms  ({baseline / duration:.1f}x)")
@@ -1,11 +1,19 @@
+import os
+import sys
 import requests  # To get the data
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 from requests.auth import HTTPBasicAuth
 from jira import JIRA
 from multiprocessing import Pool
 import config
 
+# Paths are relative to this script, so it can be started from any directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The pooled HTTP session is shared with the downloader of the issues-db-api, which
+# must be checked out next to jirarepos-download, as in this repository
+sys.path.append(os.path.join(SCRIPT_DIR, "..", "..", "issues-db-api"))
+from app.http_session import session, configure_jira_session, REQUEST_TIMEOUT
+
 from pymongo import MongoClient  # Database to store the data
 import json  # File IO
 from time import time  # To time the duration of the requests
@@ -17,7 +25,9 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 MONGO_URL = "mongodb://localhost:27017"
 INVALID_JIRAS = ["Mindville", "MariaDB"]
-with open("../data_definition/jira_data_sources.json") as f:
+with open(
+    os.path.join(SCRIPT_DIR, "..", "data_definition", "jira_data_sources.json")
+) as f:
     jira_data_sources = json.load(f)
 # Apache projects requiring authentication
 APACHE_AUTH_PROJECTS = [
@@ -45,15 +55,15 @@ def check_jira_url(jira_url):
     # CHECK PROVIDED JIRA URL AVAILABILITY
     print(f"Checking Jira url existence with GET: {jira_url}")
     try:
-        requests.head(jira_url)
-    except ConnectionError:
+        session.head(jira_url, timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.ConnectionError:
         print("❌ Provided Jira base url does not exist")
         return
     else:
         print("✅ Provided Jira base url is reachable")
 
     # CHECK PROVIDED JIRA URL API AVAILABILITY
-    response = requests.get(jira_url + "/rest/api/2/issuetype")
+    response = session.get(jira_url + "/rest/api/2/issuetype", timeout=REQUEST_TIMEOUT)
     print("")
     print(f"Checking Jira api with GET: {response.url}")
     # Check response code
@@ -67,7 +77,9 @@ def check_jira_url(jira_url):
         return
 
     # CHECK NUMBER OF ISSUES
-    response = requests.get(jira_url + "/rest/api/2/search?jql=&maxResults=0")
+    response = session.get(
+        jira_url + "/rest/api/2/search?jql=&maxResults=0", timeout=REQUEST_TIMEOUT
+    )
     print("")
     print(f"Retrieving total issue count with GET: {response.url}")
     # Check response code
@@ -121,7 +133,9 @@ def download_issue_type_info():
         # Get the issuetype definitions
         documented_issuetypes = {
             issuetype["name"]: issuetype
-            for issuetype in requests.get(jira_issuetype_url).json()
+            for issuetype in session.get(
+                jira_issuetype_url, timeout=REQUEST_TIMEOUT
+            ).json()
         }
 
         # Save the information
@@ -147,9 +161,9 @@ def download_issuelink_type_info():
         # Get the issuelinktype definitions
         documented_issuelinktypes = {
             issuelinktype["name"]: issuelinktype
-            for issuelinktype in requests.get(jira_issuelinktype_url).json()[
-                "issueLinkTypes"
-            ]
+            for issuelinktype in session.get(
+                jira_issuelinktype_url, timeout=REQUEST_TIMEOUT
+            ).json()["issueLinkTypes"]
         }
 
         # Save the information
@@ -171,7 +185,9 @@ def download_issue_field_info():
             continue
 
         # Query Jira for field information
-        response = requests.get(f"{jira_data['jira_url']}/rest/api/2/field")
+        response = session.get(
+            f"{jira_data['jira_url']}/rest/api/2/field", timeout=REQUEST_TIMEOUT
+        )
         # Store result in JSON
         jiras_fields_information[jira_name] = response.json()
 
@@ -182,21 +198,46 @@ def download_issue_field_info():
 
 def get_jira_server(jira_data_source, enable_auth=False):
     server = jira_data_source["jira_url"]
+    # Retries are done by the pooled adapter of configure_session
     if enable_auth and jira_data_source["name"] == "Apache":
-        return JIRA(server, basic_auth=(config.username, config.password))
-    return JIRA(server)
+        jira = JIRA(
+            server,
+            basic_auth=(config.username, config.password),
+            max_retries=0,
+            timeout=REQUEST_TIMEOUT,
+        )
+    else:
+        jira = JIRA(server, max_retries=0, timeout=REQUEST_TIMEOUT)
+    configure_jira_session(jira)
+    return jira
 
 
-def get_response(jira, start_index, iteration_max=100):
-    with open("download_date.json") as file:
+def get_conditions():
+    with open(os.path.join(SCRIPT_DIR, "download_date.json")) as file:
         download_date = json.load(file)["download_date"]
+    return f'updated<="{download_date}" AND updated<="2023-03-07"'
+
+
+def get_search_options(jira_data_source):
+    # Optional download profile of a data source: "download_fields" limits the
+    # downloaded fields, "download_changelog": false leaves out the changelog
+    fields = jira_data_source.get("download_fields")
+    return {
+        "fields": "*all" if fields is None else ",".join(fields),
+        "expand": (
+            "changelog" if jira_data_source.get("download_changelog", True) else None
+        ),
+    }
+
+
+def get_response(jira, start_index, iteration_max=100, search_options=None):
     return jira.search_issues(
-        f'updated<="{download_date}" AND updated<="2023-03-07" order by created asc',
+        f"{get_conditions()} order by created asc",
         # f'updated<="2023-03-07 16:00"  order by created asc',
         startAt={start_index},
         maxResults={iteration_max},
-        expand="changelog",
         json_result=True,
+        **(search_options or {"expand": "changelog"}),
     )
 
 
@@ -253,7 +294,12 @@ def download_and_write_data_mongo(
         num_items_to_retrieve = min(iteration_max, num_remaining_results)
 
         # Get issues from Jira
-        response_json = get_response(jira, start_index, num_items_to_retrieve)
+        response_json = get_response(
+            jira,
+            start_index,
+            num_items_to_retrieve,
+            get_search_options(jira_data_source),
+        )
         if "issues" in response_json:
             # Add issues to program list
             issues.extend(response_json["issues"])